@@ -0,0 +1,53 @@
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from utils import num_rows
+
+def run_autotuned(copy_func, hours, args, tolerance=0.05, decrease_factor=0.75):
+    # Additive increase, multiplicative decrease on the number of hours in flight.
+    # Every time `target` hours have completed we compare the rows/s of that window
+    # with the best window so far: a clear gain adds a worker, a clear loss cuts
+    # the worker count by decrease_factor, anything in between holds at the knee.
+    hours = deque(hours)
+    pending = set()
+    target = 1
+
+    best_rate = 0
+    window_start = time.perf_counter()
+    window_hours = 0
+
+    with ProcessPoolExecutor(max_workers=args.max_workers) as pool:
+        while hours or pending:
+            while hours and len(pending) < target:
+                pending.add(pool.submit(copy_func, hours.popleft(), args))
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+
+            window_hours += len(done)
+            if window_hours < target:
+                continue
+
+            rate = num_rows(window_hours) / (time.perf_counter() - window_start)
+
+            if rate > best_rate * (1 + tolerance):
+                new_target = min(target + 1, args.max_workers)
+                best_rate = rate
+            elif rate < best_rate * (1 - tolerance):
+                new_target = max(1, int(target * decrease_factor))
+                best_rate = rate
+            else:
+                new_target = target
+
+            print(
+                f"Autotuner: {rate:.2f} inserts per second with {target} workers "
+                f"(best {best_rate:.2f}), now using {new_target} workers."
+            )
+
+            target = new_target
+            window_start = time.perf_counter()
+            window_hours = 0
+
+    return
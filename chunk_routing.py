@@ -0,0 +1,98 @@
+from datetime import timedelta
+from collections import defaultdict
+
+import numpy as np
+import psycopg
+
+from write_csv import open_weather_dataset
+from utils import get_psycopg3_connection
+
+def chunk_time_interval(table="weather"):
+    # Returns the hypertable's chunk_time_interval, or None for a regular table,
+    # including on a server without TimescaleDB.
+    try:
+        with get_psycopg3_connection() as conn:
+            row = conn.execute("""--sql
+                select d.time_interval
+                from timescaledb_information.dimensions d
+                where d.hypertable_name = %s and d.dimension_type = 'Time';
+            """, [table]).fetchone()
+    except (psycopg.errors.InvalidSchemaName, psycopg.errors.UndefinedTable):
+        return None
+
+    return row[0] if row else None
+
+def hour_times(hours):
+    return open_weather_dataset().time.values[list(hours)]
+
+def hour_chunks(hours, interval):
+    # TimescaleDB aligns time chunks to multiples of the interval since the Unix epoch.
+    times_us = hour_times(hours).astype("datetime64[us]").astype(np.int64)
+    interval_us = interval // timedelta(microseconds=1)
+    return dict(zip(hours, (times_us // interval_us).tolist()))
+
+def assign_round_robin(hours, workers):
+    # Approximates joblib's dispatch order: at any moment the workers hold
+    # consecutive hours.
+    hours = list(hours)
+    return [hours[i::workers] for i in range(workers)]
+
+def assign_by_chunk(hours, chunks, workers):
+    # Give every chunk's hours to a single worker, largest chunks first, always
+    # to the worker with the fewest hours so far.
+    chunk_hours = defaultdict(list)
+    for n in hours:
+        chunk_hours[chunks[n]].append(n)
+
+    assignment = [[] for _ in range(workers)]
+    for group in sorted(chunk_hours.values(), key=len, reverse=True):
+        min(assignment, key=len).extend(group)
+
+    return assignment
+
+def contention(assignment, chunks):
+    chunk_workers = defaultdict(set)
+    for worker, hours in enumerate(assignment):
+        for n in hours:
+            chunk_workers[chunks[n]].add(worker)
+
+    return {
+        "chunks": len(chunk_workers),
+        "shared_chunks": sum(len(w) > 1 for w in chunk_workers.values()),
+        "max_workers_per_chunk": max((len(w) for w in chunk_workers.values()), default=0),
+        "busy_workers": sum(len(hours) > 0 for hours in assignment)
+    }
+
+def print_contention(name, stats):
+    print(
+        f"{name} routing: {stats['busy_workers']} busy workers, {stats['chunks']} chunks, "
+        f"{stats['shared_chunks']} shared by several workers, "
+        f"up to {stats['max_workers_per_chunk']} workers per chunk."
+    )
+    return
+
+def route_hours(hours, workers, routing):
+    # Returns one list of hours per worker and the contention stats of that assignment.
+    hours = list(hours)
+    round_robin = assign_round_robin(hours, workers)
+
+    interval = chunk_time_interval()
+    if interval is None:
+        print("weather is not a hypertable, so every hour is treated as its own chunk.")
+        chunks = {n: n for n in hours}
+    else:
+        chunks = hour_chunks(hours, interval)
+
+    by_chunk = assign_by_chunk(hours, chunks, workers)
+
+    stats = {
+        "round_robin": contention(round_robin, chunks),
+        "chunk": contention(by_chunk, chunks)
+    }
+
+    for name, name_stats in stats.items():
+        print_contention(name, name_stats)
+
+    assignment = by_chunk if routing == "chunk" else round_robin
+
+    return assignment, stats[routing]
@@ -1,19 +1,60 @@
 import os
+import time
+import queue
+import shutil
+import tempfile
+import asyncio
 import argparse
-from pathlib import Path
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import dotenv
-from sqlalchemy import text
 from joblib import Parallel, delayed
 
-from write_csv import weather_dataframe, write_csv
-from timer import Timer
-from utils import get_sqlalchemy_engine, get_psycopg3_connection, num_rows
+from write_csv import weather_dataframe, write_csv, write_binary, csv_chunks
+from copy_encoders import (
+    DEFAULT_CHUNK_BYTES,
+    BINARY_RECORD_DTYPE,
+    PGCOPY_HEADER,
+    PGCOPY_TRAILER,
+    copy_statement,
+    binary_copy_chunks,
+    text_copy_chunks
+)
+from timer import Timer, spans, detach_spans, set_quiet, merged_span_histograms, print_span_summary
+from recorder import record, check_headers, common_columns
+from server_metrics import METRICS_COLUMNS, sample_server_metrics
+from progress import PROGRESS_COLUMNS, add_progress, reporting_progress
+from shm_pipeline import run_shm_pipeline
+from chunk_routing import route_hours
+from autotuner import run_autotuned
+from ledger import record_hour, remaining_hours
+from post_load import (
+    convert_to_hypertable,
+    build_deferred_indexes,
+    compress_hypertable,
+    COMPRESSION_BENCHMARK_COLUMNS,
+    log_compression_benchmark,
+    phase_seconds,
+    print_phase_summary
+)
+from utils import (
+    get_psycopg3_connection,
+    get_pooled_psycopg3_connection,
+    get_async_psycopg3_connection,
+    num_rows
+)
 
 dotenv.load_dotenv()
 
 CSV_PATH = os.getenv("CSV_PATH")
 
+def workers_type(value):
+    if value == "auto":
+        return value
+    return int(value)
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description="Load data into the weather table using COPY statements."
@@ -21,7 +62,7 @@ def parse_args():
 
     parser.add_argument(
         "--method",
-        choices=["copy_csv", "psycopg3"],
+        choices=["copy_csv", "copy_csv_stream", "copy_binary", "psycopg3", "psycopg3_binary", "psycopg3_text", "async", "shm"],
         help="How to copy data into the table.",
         required=True
     )
@@ -35,11 +76,34 @@ def parse_args():
 
     parser.add_argument(
         "--workers",
-        type=int,
-        help="Number of parallel workers.",
+        type=workers_type,
+        help=(
+            "Number of parallel workers. For the async method, the number of concurrent COPY streams. "
+            "Use 'auto' to tune the worker count to the observed insert rate."
+        ),
         required=True
     )
 
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Upper bound on the number of workers with --workers auto."
+    )
+
+    parser.add_argument(
+        "--decode-workers",
+        type=int,
+        default=2,
+        help="Number of processes decoding and encoding hours for the async and shm methods."
+    )
+
+    parser.add_argument(
+        "--copy-workers",
+        type=int,
+        help="Number of COPY worker processes for the shm method. Defaults to --workers."
+    )
+
     parser.add_argument(
         "--hours",
         type=int,
@@ -47,6 +111,34 @@ def parse_args():
         required=True
     )
 
+    parser.add_argument(
+        "--reporting-period",
+        type=str,
+        help="How often to report insert rates across all workers, e.g. 10s. Off by default."
+    )
+
+    parser.add_argument(
+        "--progress-file",
+        type=str,
+        help=(
+            "Filepath to output the reported insert rates to a CSV file like benchmarks_parallel_tpc.csv. "
+            "Reports every 10s unless --reporting-period is given."
+        )
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="Filepath to output server metrics sampled during the load to a CSV file."
+    )
+
+    parser.add_argument(
+        "--metrics-period",
+        type=float,
+        default=5,
+        help="Seconds between server metrics samples."
+    )
+
     parser.add_argument(
         "--benchmarks-file",
         type=str,
@@ -60,64 +152,266 @@ def parse_args():
         help="Filepath to output parallel benchmarks to a CSV file."
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--strategy",
+        choices=["direct", "convert"],
+        default="direct",
+        help=(
+            "With --table-type hyper, load straight into a hypertable, or load a regular table "
+            "and convert it to a hypertable afterwards."
+        )
+    )
 
-def log_benchmark(args, hour, num_rows, full_timer, copy_timer):
-    filepath = args.benchmarks_file
-    
-    # Create file and write CSV header
-    if not Path(filepath).exists():
-        with open(filepath, "a") as file:
-            file.write(
-                "method,table_type,workers,hour,num_rows,"
-                "seconds_full,rate_full,units_full,"
-                "seconds_copy,rate_copy,units_copy\n"
-            )
-    
-    with open(filepath, "a") as file:
-        file.write(
-            f"{args.method},{args.table_type},{args.workers},{hour},{num_rows},"
-            f"{full_timer.interval},{full_timer.rate},{full_timer.units},"
-            f"{copy_timer.interval},{copy_timer.rate},{copy_timer.units}\n"
+    parser.add_argument(
+        "--defer-indexes",
+        action="store_true",
+        default=False,
+        help=(
+            "The hypertable was created with create_table.py --defer-indexes, so build its time index "
+            "per chunk in parallel after loading."
         )
-    
+    )
+
+    parser.add_argument(
+        "--maintenance-work-mem",
+        type=str,
+        help="maintenance_work_mem for the deferred index builds, e.g. 1GB."
+    )
+
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        default=False,
+        help="Enable compression on the hypertable and compress every chunk after loading."
+    )
+
+    parser.add_argument(
+        "--compress-segmentby",
+        type=str,
+        default="location_id",
+        help="Columns for timescaledb.compress_segmentby."
+    )
+
+    parser.add_argument(
+        "--compress-orderby",
+        type=str,
+        default="time desc",
+        help="Columns for timescaledb.compress_orderby."
+    )
+
+    parser.add_argument(
+        "--compression-benchmarks-file",
+        type=str,
+        help="Filepath to output compression benchmarks to a CSV file."
+    )
+
+    parser.add_argument(
+        "--routing",
+        choices=["round_robin", "chunk"],
+        default="round_robin",
+        help="Hand hours to workers as they free up, or give each worker a disjoint set of hypertable chunks."
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Skip hours that the load ledger records as already loaded."
+    )
+
+    parser.add_argument(
+        "--warm-up",
+        action="store_true",
+        default=False,
+        help="Warm up each worker's connection before its first COPY."
+    )
+
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        default=False,
+        help="Silence the per-hour timer output of every worker and only print the summaries."
+    )
+
+    parser.add_argument(
+        "--spans-benchmarks-file",
+        type=str,
+        help="Filepath to output latency percentiles of every named stage, e.g. decode or commit, to a CSV file."
+    )
+
+    parser.add_argument(
+        "--hours-per-transaction",
+        type=int,
+        default=1,
+        help="Hours each worker commits per transaction, roughly 1 million rows per hour."
+    )
+
+    args = parser.parse_args()
+
+    if args.copy_workers is None:
+        args.copy_workers = args.workers
+
+    if args.workers == "auto" and (args.method in ["async", "shm"] or args.routing == "chunk"):
+        parser.error("--workers auto only supports the per-hour methods with round_robin routing.")
+
+    if args.routing == "chunk" and args.method in ["async", "shm"]:
+        parser.error(f"--routing chunk is not supported by the {args.method} method.")
+
+    if args.hours_per_transaction < 1:
+        parser.error("--hours-per-transaction must be at least 1.")
+
+    if args.workers == "auto" and args.hours_per_transaction > 1:
+        parser.error("--workers auto only supports --hours-per-transaction 1.")
+
+    # Refuse results files with other columns now rather than after the load.
+    try:
+        check_headers([
+            (args.benchmarks_file, BENCHMARK_COLUMNS + common_columns()),
+            (args.parallel_benchmarks_file, PARALLEL_BENCHMARK_COLUMNS + common_columns()),
+            (args.spans_benchmarks_file, SPAN_BENCHMARK_COLUMNS + common_columns()),
+            (args.compression_benchmarks_file, COMPRESSION_BENCHMARK_COLUMNS + common_columns()),
+            (args.progress_file, PROGRESS_COLUMNS),
+            (args.metrics_file, METRICS_COLUMNS)
+        ])
+    except ValueError as e:
+        parser.error(str(e))
+
+    return args
+
+BENCHMARK_COLUMNS = [
+    "method",
+    "table_type",
+    "workers",
+    "hour",
+    "num_rows",
+    "seconds_full",
+    "rate_full",
+    "units_full",
+    "seconds_copy",
+    "rate_copy",
+    "units_copy",
+    "seconds_connect",
+    "hours_per_transaction"
+]
+
+def log_benchmark(args, hour, num_rows, full_timer, copy_timer, connect_seconds):
+    # Every method logs each hour once it is copied, in whichever process copied it.
+    add_progress(num_rows)
+
+    record(args.benchmarks_file, {
+        "method": args.method,
+        "table_type": args.table_type,
+        "workers": args.workers,
+        "hour": hour,
+        "num_rows": num_rows,
+        "seconds_full": full_timer.interval,
+        "rate_full": full_timer.rate,
+        "units_full": full_timer.units,
+        "seconds_copy": copy_timer.interval,
+        "rate_copy": copy_timer.rate,
+        "units_copy": copy_timer.units,
+        "seconds_connect": connect_seconds,
+        "hours_per_transaction": args.hours_per_transaction
+    })
     return
 
-def log_parallel_benchmark(args, timer):
-    filepath = args.parallel_benchmarks_file
-    
-    # Create file and write CSV header
-    if not Path(filepath).exists():
-        with open(filepath, "a") as file:
-            file.write(
-                "method,table_type,workers,hours,num_rows,"
-                "seconds,rate,units\n"
-            )
-    
-    with open(filepath, "a") as file:
-        file.write(
-            f"{args.method},{args.table_type},{args.workers},{args.hours},{num_rows(args.hours)},"
-            f"{timer.interval},{timer.rate},{timer.units}\n"
-        )
-    
+PARALLEL_BENCHMARK_COLUMNS = [
+    "method",
+    "table_type",
+    "workers",
+    "hours",
+    "num_rows",
+    "seconds",
+    "rate",
+    "units",
+    "routing",
+    "chunks",
+    "shared_chunks",
+    "max_workers_per_chunk",
+    "strategy",
+    "seconds_set_logged",
+    "seconds_convert",
+    "seconds_index",
+    "hours_per_transaction",
+    "rows_per_transaction"
+]
+
+def log_parallel_benchmark(args, hours_loaded, timer, routing_stats, post_load_timers):
+    # With --resume, hours_loaded leaves out the hours already in the ledger,
+    # which the timer did not cover either.
+    record(args.parallel_benchmarks_file, {
+        "method": args.method,
+        "table_type": args.table_type,
+        "workers": args.workers,
+        "hours": hours_loaded,
+        "num_rows": num_rows(hours_loaded),
+        "seconds": timer.interval,
+        "rate": timer.rate,
+        "units": timer.units,
+        "routing": args.routing,
+        "chunks": routing_stats.get("chunks", ""),
+        "shared_chunks": routing_stats.get("shared_chunks", ""),
+        "max_workers_per_chunk": routing_stats.get("max_workers_per_chunk", ""),
+        "strategy": args.strategy,
+        "seconds_set_logged": phase_seconds(post_load_timers, "set_logged"),
+        "seconds_convert": phase_seconds(post_load_timers, "convert"),
+        "seconds_index": phase_seconds(post_load_timers, "index"),
+        "hours_per_transaction": args.hours_per_transaction,
+        "rows_per_transaction": num_rows(args.hours_per_transaction)
+    })
     return
 
-def copy_data_using_psycopg3(n, args):
+SPAN_BENCHMARK_COLUMNS = [
+    "method",
+    "table_type",
+    "workers",
+    "hours",
+    "span",
+    "count",
+    "seconds_total",
+    "seconds_p50",
+    "seconds_p90",
+    "seconds_p99",
+    "seconds_max"
+]
+
+def log_span_benchmark(args, histograms):
+    for name, histogram in histograms.items():
+        record(args.spans_benchmarks_file, {
+            "method": args.method,
+            "table_type": args.table_type,
+            "workers": args.workers,
+            "hours": args.hours,
+            "span": name,
+            "count": histogram.count,
+            "seconds_total": histogram.total,
+            "seconds_p50": histogram.percentile(50),
+            "seconds_p90": histogram.percentile(90),
+            "seconds_p99": histogram.percentile(99),
+            "seconds_max": histogram.max
+        })
+    return
+
+def copy_data_using_psycopg3(n, args, commit=True):
     df = weather_dataframe(n)
     
     full_timer = Timer(
         f"COPYing data using psycopg3 cursor (counting overhead)",
         n=df.shape[0],
-        units="inserts"
+        units="inserts",
+        name="hour"
     )
 
     copy_timer = Timer(
         f"COPYing data using psycopg3 cursor",
         n=df.shape[0],
-        units="inserts"
+        units="inserts",
+        name="copy"
     )
 
-    with get_psycopg3_connection() as conn, conn.cursor() as cur, full_timer:
+    conn, connect_seconds = get_pooled_psycopg3_connection(warm_up=args.warm_up, keep_transaction=not commit)
+
+    with conn.cursor() as cur, full_timer:
         with cur.copy("""
             copy weather (
                 time,
@@ -135,74 +429,437 @@ def copy_data_using_psycopg3(n, args):
         ) as copy, copy_timer:
             for row in df.itertuples(index=False, name=None):
                 copy.write_row(row)
+
+        record_hour(cur, n, df.shape[0])
+        if commit:
+            with Timer(name="commit", quiet=True):
+                conn.commit()
     
-        conn.commit()
-    
-    log_benchmark(args, n, df.shape[0], full_timer, copy_timer)
+    log_benchmark(args, n, df.shape[0], full_timer, copy_timer, connect_seconds)
 
     return
 
-def copy_data_using_csv(n, args):
+def copy_data_using_encoder(n, args, commit=True):
+    df = weather_dataframe(n)
+
+    if args.method == "psycopg3_binary":
+        copy_format, encode = "binary", binary_copy_chunks
+    elif args.method == "psycopg3_text":
+        copy_format, encode = "text", text_copy_chunks
+
+    full_timer = Timer(
+        f"COPYing pre-encoded {copy_format} data using psycopg3 cursor (counting overhead)",
+        n=df.shape[0],
+        units="inserts",
+        name="hour"
+    )
+
+    copy_timer = Timer(
+        f"COPYing pre-encoded {copy_format} data using psycopg3 cursor",
+        n=df.shape[0],
+        units="inserts",
+        name="copy"
+    )
+
+    conn, connect_seconds = get_pooled_psycopg3_connection(warm_up=args.warm_up, keep_transaction=not commit)
+
+    with conn.cursor() as cur, full_timer:
+        with cur.copy(copy_statement(copy_format)) as copy, copy_timer:
+            for chunk in spans(encode(df), "encode"):
+                with Timer(name="write", quiet=True):
+                    copy.write(chunk)
+
+        record_hour(cur, n, df.shape[0])
+        if commit:
+            with Timer(name="commit", quiet=True):
+                conn.commit()
+
+    log_benchmark(args, n, df.shape[0], full_timer, copy_timer, connect_seconds)
+
+    return
+
+def produce_in_thread(chunks, max_pending=4):
+    # Run the chunk generator in a producer thread so formatting the next chunk
+    # overlaps with the server ingesting the current one.
+    pending = queue.Queue(maxsize=max_pending)
+    stopped = threading.Event()
+    done = object()
+    errors = []
+
+    def put(item):
+        # Gives up once the consumer has stopped, e.g. because copy.write raised.
+        while not stopped.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if not put(chunk):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(done)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while (chunk := pending.get()) is not done:
+            yield chunk
+    finally:
+        stopped.set()
+        producer.join()
+        # Drop any chunks still queued along with the thread.
+        while not pending.empty():
+            pending.get_nowait()
+
+    if errors:
+        raise errors[0]
+
+    return
+
+def copy_data_using_csv_stream(n, args, commit=True):
+    df = weather_dataframe(n)
+
+    full_timer = Timer(
+        "COPYing streamed CSV data using COPY FROM STDIN (counting overhead)",
+        n=df.shape[0],
+        units="inserts",
+        name="hour"
+    )
+
+    copy_timer = Timer(
+        "COPYing streamed CSV data using COPY FROM STDIN",
+        n=df.shape[0],
+        units="inserts",
+        name="copy"
+    )
+
+    conn, connect_seconds = get_pooled_psycopg3_connection(warm_up=args.warm_up, keep_transaction=not commit)
+
+    with conn.cursor() as cur, full_timer:
+        with cur.copy(copy_statement("csv")) as copy, copy_timer:
+            for chunk in spans(produce_in_thread(csv_chunks(df)), "encode"):
+                with Timer(name="write", quiet=True):
+                    copy.write(chunk)
+
+        record_hour(cur, n, df.shape[0])
+        if commit:
+            with Timer(name="commit", quiet=True):
+                conn.commit()
+
+    log_benchmark(args, n, df.shape[0], full_timer, copy_timer, connect_seconds)
+
+    return
+
+def copy_data_using_csv(n, args, commit=True):
     df = weather_dataframe(n)
 
     full_timer = Timer(
         f"COPYing data using COPY (counting overhead)",
         n=df.shape[0],
-        units="inserts"
+        units="inserts",
+        name="hour"
     )
 
     copy_timer = Timer(
         f"COPYing data using COPY",
         n=df.shape[0],
-        units="inserts"
+        units="inserts",
+        name="copy"
     )
 
+    conn, connect_seconds = get_pooled_psycopg3_connection(warm_up=args.warm_up, keep_transaction=not commit)
+
     with full_timer:
         csv_filepath = f"{CSV_PATH}/weather_hour{n}.csv"
         write_csv(df, csv_filepath)
 
-        engine = get_sqlalchemy_engine()
-
-        with engine.connect() as conn, copy_timer:
-            conn.execute(text(f"""--sql
+        with conn.cursor() as cur, copy_timer:
+            cur.execute(f"""--sql
                 copy weather
                 from '{csv_filepath}'
                 delimiter ','
                 csv header;
-            """))
-            conn.commit()
+            """)
+            record_hour(cur, n, df.shape[0])
+            if commit:
+                with Timer(name="commit", quiet=True):
+                    conn.commit()
 
-    log_benchmark(args, n, df.shape[0], full_timer, copy_timer)
+    log_benchmark(args, n, df.shape[0], full_timer, copy_timer, connect_seconds)
 
     return
 
+def binary_file_rows(filepath):
+    size = os.path.getsize(filepath) - len(PGCOPY_HEADER) - len(PGCOPY_TRAILER)
+    return size // BINARY_RECORD_DTYPE.itemsize
+
+def copy_data_using_binary_file(n, args, commit=True):
+    # Loads the weather_hour{n}.bin files written by write_csv.py --formats binary,
+    # so the server neither decodes NetCDF nor parses text during the load. Hours
+    # without a file are encoded on the spot.
+    binary_filepath = f"{CSV_PATH}/weather_hour{n}.bin"
+    if not os.path.exists(binary_filepath):
+        write_binary(weather_dataframe(n), binary_filepath)
+
+    rows = binary_file_rows(binary_filepath)
+
+    full_timer = Timer(
+        "COPYing binary data using COPY (counting overhead)",
+        n=rows,
+        units="inserts",
+        name="hour"
+    )
+
+    copy_timer = Timer(
+        "COPYing binary data using COPY",
+        n=rows,
+        units="inserts",
+        name="copy"
+    )
+
+    conn, connect_seconds = get_pooled_psycopg3_connection(warm_up=args.warm_up, keep_transaction=not commit)
+
+    with conn.cursor() as cur, full_timer:
+        with copy_timer:
+            cur.execute(f"""--sql
+                copy weather
+                from '{binary_filepath}'
+                with (format binary);
+            """)
+        record_hour(cur, n, rows)
+        if commit:
+            with Timer(name="commit", quiet=True):
+                conn.commit()
+
+    log_benchmark(args, n, rows, full_timer, copy_timer, connect_seconds)
+
+    return
+
+def encode_hour(n):
+    df = weather_dataframe(n)
+    return n, df.shape[0], b"".join(binary_copy_chunks(df))
+
+async def decode_hours(hours, blocks, args):
+    # Keep at most --decode-workers hours in flight. Together with the bounded
+    # queue this caps how many encoded hours sit in memory at once.
+    loop = asyncio.get_running_loop()
+
+    with ProcessPoolExecutor(max_workers=args.decode_workers) as pool:
+        pending = deque()
+
+        for n in hours:
+            pending.append(loop.run_in_executor(pool, encode_hour, n))
+            if len(pending) >= args.decode_workers:
+                await blocks.put(await pending.popleft())
+
+        while pending:
+            await blocks.put(await pending.popleft())
+
+    # One sentinel per COPY stream.
+    for _ in range(args.workers):
+        await blocks.put(None)
+
+    return
+
+async def copy_stream_async(blocks, args):
+    detach_spans()
+
+    start = time.perf_counter()
+    conn = await get_async_psycopg3_connection()
+    connect_seconds = time.perf_counter() - start
+
+    # Hours copied since the last commit, committed every --hours-per-transaction.
+    uncommitted = 0
+
+    async with conn:
+        while (block := await blocks.get()) is not None:
+            n, num_rows, data = block
+
+            full_timer = Timer(
+                f"COPYing hour {n} of pre-encoded binary data using psycopg3 async cursor (counting overhead)",
+                n=num_rows,
+                units="inserts",
+                name="hour"
+            )
+
+            copy_timer = Timer(
+                f"COPYing hour {n} of pre-encoded binary data using psycopg3 async cursor",
+                n=num_rows,
+                units="inserts",
+                name="copy"
+            )
+
+            with full_timer:
+                async with conn.cursor() as cur:
+                    with copy_timer:
+                        async with cur.copy(copy_statement("binary")) as copy:
+                            data = memoryview(data)
+                            for offset in range(0, len(data), DEFAULT_CHUNK_BYTES):
+                                with Timer(name="write", quiet=True):
+                                    await copy.write(data[offset:offset + DEFAULT_CHUNK_BYTES])
+
+                    await record_hour(cur, n, num_rows)
+
+                uncommitted += 1
+                if uncommitted == args.hours_per_transaction:
+                    with Timer(name="commit", quiet=True):
+                        await conn.commit()
+                    uncommitted = 0
+
+            log_benchmark(args, n, num_rows, full_timer, copy_timer, connect_seconds)
+            connect_seconds = 0.0
+
+        if uncommitted:
+            await conn.commit()
+
+    return
+
+async def load_data_async(hours, args):
+    blocks = asyncio.Queue(maxsize=args.decode_workers)
+
+    await asyncio.gather(
+        decode_hours(hours, blocks, args),
+        *[copy_stream_async(blocks, args) for _ in range(args.workers)]
+    )
+
+    return
+
+def transaction_groups(hours, hours_per_transaction):
+    hours = list(hours)
+    return [hours[i:i + hours_per_transaction] for i in range(0, len(hours), hours_per_transaction)]
+
+def copy_transaction(copy_func, hours, args):
+    # Copy several hours on this process's pooled connection and commit them as
+    # one transaction.
+    conn, _ = get_pooled_psycopg3_connection(warm_up=args.warm_up)
+
+    for n in hours:
+        copy_func(n, args, commit=False)
+
+    with Timer(f"Committing {len(hours)} hours ({num_rows(len(hours))} rows) in one transaction", name="commit"):
+        conn.commit()
+
+    return
+
+def copy_hours(copy_func, hours, args):
+    if args.hours_per_transaction == 1:
+        for n in hours:
+            copy_func(n, args)
+    else:
+        for group in transaction_groups(hours, args.hours_per_transaction):
+            copy_transaction(copy_func, group, args)
+    return
+
 def main(args):    
     if args.method == "psycopg3":
         copy_func = copy_data_using_psycopg3
+    elif args.method in ["psycopg3_binary", "psycopg3_text"]:
+        copy_func = copy_data_using_encoder
     elif args.method == "copy_csv":
         copy_func = copy_data_using_csv
+    elif args.method == "copy_csv_stream":
+        copy_func = copy_data_using_csv_stream
+    elif args.method == "copy_binary":
+        copy_func = copy_data_using_binary_file
+
+    # Set in the environment before any worker starts so that every worker
+    # inherits them. Each process saves its span histograms under spans_path.
+    if args.quiet:
+        set_quiet()
+    spans_path = tempfile.mkdtemp(prefix="copy_data_spans_")
+    os.environ["TIMER_SPANS_PATH"] = spans_path
     
+    with get_psycopg3_connection() as conn:
+        hours = remaining_hours(conn, range(args.hours), args.resume)
+
     timer = Timer(
-        f"COPYing {args.hours} hours of data using {args.method} "
+        f"COPYing {len(hours)} hours of data using {args.method} "
         f"with {args.workers} workers",
-        n=num_rows(args.hours),
-        units="inserts"
+        n=num_rows(len(hours)),
+        units="inserts",
+        quiet=False
     )
 
-    with timer:
-        if args.workers == 1:
-            for n in range(args.hours):
-                copy_func(n, args)
+    # Contention stats only mean something for hypertables, so a regular table
+    # is only routed when --routing chunk asks for it.
+    routing_stats = {}
+    if (
+        args.workers != "auto" and args.workers > 1 and args.method not in ["async", "shm"]
+        and (args.table_type == "hyper" or args.routing == "chunk")
+    ):
+        assignment, routing_stats = route_hours(hours, args.workers, args.routing)
+
+    progress_fields = {"method": args.method, "table_type": args.table_type, "num_workers": args.workers}
+
+    with timer, reporting_progress(args.reporting_period, args.progress_file, progress_fields):
+        if args.method == "async":
+            asyncio.run(load_data_async(hours, args))
+        elif args.method == "shm":
+            run_shm_pipeline(hours, args, log_benchmark)
+        elif args.workers == "auto":
+            run_autotuned(copy_func, hours, args)
+        elif args.workers == 1:
+            copy_hours(copy_func, hours, args)
+        elif args.routing == "chunk":
+            Parallel(n_jobs=args.workers)(
+                delayed(copy_hours)(copy_func, hours, args)
+                for hours in assignment if hours
+            )
+        elif args.hours_per_transaction > 1:
+            Parallel(n_jobs=args.workers)(
+                delayed(copy_transaction)(copy_func, group, args)
+                for group in transaction_groups(hours, args.hours_per_transaction)
+            )
         else:
             Parallel(n_jobs=args.workers)(
                 delayed(copy_func)(n, args)
-                for n in range(args.hours)
+                for n in hours
             )
     
+    post_load_timers = {}
+    if args.table_type == "hyper" and args.strategy == "convert":
+        post_load_timers.update(convert_to_hypertable(len(hours), create_default_indexes=not args.defer_indexes))
+
+    # Post-load stages run on as many connections as the load used.
+    post_load_workers = args.max_workers if args.workers == "auto" else args.workers
+
+    if args.table_type == "hyper" and args.defer_indexes:
+        post_load_timers["index"] = build_deferred_indexes(post_load_workers, args.maintenance_work_mem)
+
+    if args.compress:
+        if args.table_type != "hyper":
+            print("Only hypertables can be compressed, skipping compression.")
+        else:
+            post_load_timers["compress"], compression_stats = compress_hypertable(
+                post_load_workers, args.compress_segmentby, args.compress_orderby
+            )
+            if args.compression_benchmarks_file:
+                log_compression_benchmark(args, len(hours), post_load_workers, post_load_timers["compress"], compression_stats)
+
+    if post_load_timers:
+        print_phase_summary(timer, post_load_timers)
+
     if args.parallel_benchmarks_file:
-        log_parallel_benchmark(args, timer)      
+        log_parallel_benchmark(args, len(hours), timer, routing_stats, post_load_timers)
+
+    span_histograms = merged_span_histograms(spans_path)
+    print_span_summary(span_histograms)
+    if args.spans_benchmarks_file:
+        log_span_benchmark(args, span_histograms)
+    shutil.rmtree(spans_path, ignore_errors=True)
 
     return
 
 if __name__ == "__main__":
-    main(parse_args())
+    args = parse_args()
+
+    with sample_server_metrics(args.metrics_file, args.metrics_period):
+        main(args)
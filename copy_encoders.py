@@ -0,0 +1,223 @@
+import struct
+
+import numpy as np
+
+COLUMNS = [
+    "time",
+    "location_id",
+    "latitude",
+    "longitude",
+    "temperature_2m",
+    "zonal_wind_10m",
+    "meridional_wind_10m",
+    "total_cloud_cover",
+    "total_precipitation",
+    "snowfall"
+]
+
+FLOAT_COLUMNS = COLUMNS[2:]
+
+# Hand the COPY stream multi-megabyte buffers so psycopg's per-write overhead vanishes.
+DEFAULT_CHUNK_BYTES = 8 * 1024**2
+
+# Binary COPY signature, flags field and header extension length.
+# See https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+PGCOPY_TRAILER = struct.pack(">h", -1)
+
+# timestamptz is sent as microseconds since 2000-01-01 00:00:00 UTC.
+POSTGRES_EPOCH_OFFSET_US = 946_684_800 * 1_000_000
+
+# Size of one fixed-width text row with 9 significant digits per float.
+TEXT_ROW_BYTES_ESTIMATE = 155
+
+def copy_statement(format="text"):
+    columns = ",\n            ".join(COLUMNS)
+    statement = f"""
+        copy weather (
+            {columns}
+        ) from stdin
+    """
+    if format in ["binary", "csv"]:
+        statement += f" (format {format})"
+    return statement
+
+def binary_record_dtype():
+    # Every tuple is a field count followed by (length, value) pairs. All our
+    # columns are fixed width and never null, so one tuple maps onto a packed
+    # big-endian NumPy record of 86 bytes.
+    fields = [
+        ("num_fields", ">i2"),
+        ("time_length", ">i4"),
+        ("time", ">i8"),
+        ("location_id_length", ">i4"),
+        ("location_id", ">i4")
+    ]
+    for col in FLOAT_COLUMNS:
+        fields += [(f"{col}_length", ">i4"), (col, ">f4")]
+    return np.dtype(fields)
+
+BINARY_RECORD_DTYPE = binary_record_dtype()
+
+def column_arrays(df):
+    arrays = {col: df[col].to_numpy() for col in COLUMNS}
+    arrays["time"] = (
+        arrays["time"].astype("datetime64[us]").astype(np.int64)
+        - POSTGRES_EPOCH_OFFSET_US
+    )
+    return arrays
+
+def fill_binary_records(arrays, out, start=0):
+    stop = start + out.shape[0]
+
+    out["num_fields"] = len(COLUMNS)
+    out["time_length"] = 8
+    out["time"] = arrays["time"][start:stop]
+    out["location_id_length"] = 4
+    out["location_id"] = arrays["location_id"][start:stop]
+
+    for col in FLOAT_COLUMNS:
+        out[f"{col}_length"] = 4
+        out[col] = arrays[col][start:stop]
+
+    return out
+
+def binary_copy_size(num_rows):
+    return len(PGCOPY_HEADER) + num_rows * BINARY_RECORD_DTYPE.itemsize + len(PGCOPY_TRAILER)
+
+def write_binary_copy(df, buffer):
+    # Encode a whole binary COPY stream straight into a writable buffer, e.g. a
+    # shared memory slot, and return the number of bytes written.
+    num_rows = df.shape[0]
+    size = binary_copy_size(num_rows)
+
+    out = np.frombuffer(buffer, dtype=np.uint8, count=size)
+    out[:len(PGCOPY_HEADER)] = np.frombuffer(PGCOPY_HEADER, dtype=np.uint8)
+    out[size - len(PGCOPY_TRAILER):] = np.frombuffer(PGCOPY_TRAILER, dtype=np.uint8)
+
+    records = out[len(PGCOPY_HEADER):size - len(PGCOPY_TRAILER)].view(BINARY_RECORD_DTYPE)
+    fill_binary_records(column_arrays(df), records)
+
+    return size
+
+def binary_copy_chunks(df, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    arrays = column_arrays(df)
+    num_rows = df.shape[0]
+    rows_per_chunk = max(1, chunk_bytes // BINARY_RECORD_DTYPE.itemsize)
+
+    yield PGCOPY_HEADER
+
+    records = np.empty(min(rows_per_chunk, num_rows), dtype=BINARY_RECORD_DTYPE)
+    for start in range(0, num_rows, rows_per_chunk):
+        chunk = records[:min(rows_per_chunk, num_rows - start)]
+        fill_binary_records(arrays, chunk, start)
+        yield chunk.tobytes()
+
+    yield PGCOPY_TRAILER
+
+# ASCII digits of 000 to 999, used to convert integers three digits at a time.
+THREE_DIGITS = np.array([list(f"{i:03d}".encode()) for i in range(1000)], dtype=np.uint8)
+
+def ascii_digits(values, num_digits):
+    # Zero-padded ASCII digits of non-negative integers, most significant first.
+    num_groups = -(-num_digits // 3)
+    out = np.empty((values.shape[0], 3 * num_groups), dtype=np.uint8)
+    dtype = np.uint32 if num_digits <= 9 else np.uint64
+    values = values.astype(dtype)
+    for group in range(num_groups - 1, -1, -1):
+        values, remainder = np.divmod(values, dtype(1000))
+        out[:, 3 * group:3 * group + 3] = np.take(THREE_DIGITS, remainder, axis=0)
+    return out[:, 3 * num_groups - num_digits:]
+
+def format_times(times):
+    # An hour holds a single timestamp, so only format the unique values.
+    uniques, inverse = np.unique(times, return_inverse=True)
+    formatted = np.char.replace(np.datetime_as_string(uniques, unit="s"), "T", " ")
+    formatted = np.char.add(formatted, "+00").astype("S")
+    table = formatted.view(np.uint8).reshape(len(uniques), -1)
+    return table[inverse.ravel()]
+
+def format_ints(values, width=8):
+    values = values.astype(np.int64)
+    out = np.empty((values.shape[0], width), dtype=np.uint8)
+    out[:, 0] = np.where(values < 0, ord("-"), ord(" "))
+    out[:, 1:] = ascii_digits(np.abs(values), width - 1)
+    return out
+
+def format_floats(values, significant_digits=9):
+    # Scientific notation with a fixed number of significant digits, e.g.
+    # " 2.73150000e+02". Nine digits round-trip every float4 exactly. Fields are
+    # fixed width and padded with spaces, which float4in skips.
+    if significant_digits < 3:
+        raise ValueError(f"Need at least 3 significant digits, got {significant_digits}.")
+
+    values = values.astype(np.float32).astype(np.float64)
+    finite = np.isfinite(values)
+    magnitude = np.abs(np.where(finite, values, 0))
+    nonzero = magnitude > 0
+
+    exponent = np.zeros(values.shape[0], dtype=np.int64)
+    exponent[nonzero] = np.floor(np.log10(magnitude[nonzero])).astype(np.int64)
+
+    def mantissa_for(exponent):
+        return np.rint(magnitude * 10.0**(significant_digits - 1 - exponent)).astype(np.int64)
+
+    # log10 and rounding can be off by one decade near powers of ten.
+    mantissa = mantissa_for(exponent)
+    exponent += (mantissa >= 10**significant_digits)
+    exponent -= nonzero & (mantissa < 10**(significant_digits - 1))
+    mantissa = mantissa_for(exponent)
+
+    width = significant_digits + 6
+    out = np.empty((values.shape[0], width), dtype=np.uint8)
+    digits = ascii_digits(mantissa, significant_digits)
+
+    out[:, 0] = np.where(values < 0, ord("-"), ord(" "))
+    out[:, 1] = digits[:, 0]
+    out[:, 2] = ord(".")
+    out[:, 3:significant_digits + 2] = digits[:, 1:]
+    out[:, significant_digits + 2] = ord("e")
+    out[:, significant_digits + 3] = np.where(exponent < 0, ord("-"), ord("+"))
+    out[:, significant_digits + 4:] = ascii_digits(np.abs(exponent), 2)
+
+    for special, mask in [
+        (b"NaN", np.isnan(values)),
+        (b"Infinity", np.isposinf(values)),
+        (b"-Infinity", np.isneginf(values))
+    ]:
+        if mask.any():
+            out[mask] = np.frombuffer(special.rjust(width), dtype=np.uint8)
+
+    return out
+
+def text_block(df, start, stop, delimiter="\t", significant_digits=9):
+    # Every row is a fixed-width record so the whole block is assembled as one
+    # (rows, width) byte matrix without any per-row Python work.
+    fields = [
+        format_times(df["time"].to_numpy()[start:stop]),
+        format_ints(df["location_id"].to_numpy()[start:stop])
+    ]
+    fields += [
+        format_floats(df[col].to_numpy()[start:stop], significant_digits)
+        for col in FLOAT_COLUMNS
+    ]
+
+    width = sum(field.shape[1] + 1 for field in fields)
+    out = np.empty((stop - start, width), dtype=np.uint8)
+
+    offset = 0
+    for field in fields:
+        out[:, offset:offset + field.shape[1]] = field
+        offset += field.shape[1]
+        out[:, offset] = ord(delimiter)
+        offset += 1
+    out[:, -1] = ord("\n")
+
+    return out.tobytes()
+
+def text_copy_chunks(df, chunk_bytes=DEFAULT_CHUNK_BYTES, delimiter="\t"):
+    num_rows = df.shape[0]
+    rows_per_chunk = max(1, chunk_bytes // TEXT_ROW_BYTES_ESTIMATE)
+
+    for start in range(0, num_rows, rows_per_chunk):
+        yield text_block(df, start, min(start + rows_per_chunk, num_rows), delimiter)
@@ -1,8 +1,12 @@
 import argparse
+from datetime import timezone
 
 from sqlalchemy import text
 
-from utils import get_sqlalchemy_engine
+from timer import Timer
+from recorder import record
+from ledger import CREATE_LEDGER_QUERY, DROP_LEDGER_QUERY
+from utils import get_sqlalchemy_engine, get_psycopg3_connection
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -23,15 +27,85 @@ def parse_args():
         required=True
     )
 
+    parser.add_argument(
+        "--strategy",
+        choices=["direct", "convert"],
+        default="direct",
+        help=(
+            "With --table-type hyper, load straight into a hypertable, or load a regular table "
+            "and convert it to a hypertable afterwards."
+        )
+    )
+
+    parser.add_argument(
+        "--defer-indexes",
+        action="store_true",
+        default=False,
+        help="Create the hypertable without its default time index. The loaders build it after loading."
+    )
+
+    parser.add_argument(
+        "--chunk-time-interval",
+        type=str,
+        help="Chunk time interval of the hypertable, e.g. '1 day'. Defaults to TimescaleDB's 7 days."
+    )
+
     parser.add_argument(
         "--unlogged",
         action="store_true",
         default=False,
         help="Make the table unlogged."
     )
+
+    parser.add_argument(
+        "--precreate-chunks-hours",
+        type=int,
+        help="Create every hypertable chunk needed to hold this many hours of ERA5 data before loading."
+    )
+
+    parser.add_argument(
+        "--benchmarks-file",
+        type=str,
+        help="Filepath to output benchmarks of table preparation phases to a CSV file."
+    )
     
     return parser.parse_args()
 
+def log_benchmark(args, phase, timer, chunks):
+    record(args.benchmarks_file, {
+        "phase": phase,
+        "table_type": args.table_type,
+        "hours": args.precreate_chunks_hours,
+        "chunks": chunks,
+        "seconds": timer.interval
+    })
+    return
+
+def precreate_chunks(hours):
+    # Imported here so creating a table does not require the NetCDF files.
+    from chunk_routing import chunk_time_interval, hour_chunks, hour_times
+
+    # Inserting the first hour of every chunk makes TimescaleDB create the chunk.
+    # Deleting the placeholder rows afterwards leaves the empty chunks behind, so
+    # the parallel load never stalls on chunk creation.
+    first_hours = {}
+    for n, chunk in hour_chunks(range(hours), chunk_time_interval()).items():
+        first_hours.setdefault(chunk, n)
+
+    times = [
+        t.astype("datetime64[us]").item().replace(tzinfo=timezone.utc)
+        for t in hour_times(sorted(first_hours.values()))
+    ]
+
+    timer = Timer(f"Pre-creating {len(times)} chunks for {hours} hours")
+
+    with get_psycopg3_connection() as conn, timer:
+        conn.execute("insert into weather (time) select unnest(%s::timestamptz[]);", [times])
+        conn.execute("delete from weather where location_id is null;")
+        conn.commit()
+
+    return timer, len(times)
+
 
 def main(args):
     engine = get_sqlalchemy_engine()
@@ -39,6 +113,7 @@ def main(args):
     with engine.connect() as conn:
         if args.drop_table:
             conn.execute(text("drop table if exists weather;"))
+            conn.execute(text(DROP_LEDGER_QUERY))
         
         unlogged = "unlogged" if args.unlogged else ""
         table_creation_query = f"""--sql
@@ -57,11 +132,38 @@ def main(args):
         """
 
         conn.execute(text(table_creation_query))
+        conn.execute(text(CREATE_LEDGER_QUERY))
 
-        if args.table_type == "hyper":
-            conn.execute(text("select create_hypertable('weather', 'time');"))
+        # With --strategy convert the loader turns the table into a hypertable after loading.
+        if args.table_type == "hyper" and args.strategy == "direct":
+            create_default_indexes = "false" if args.defer_indexes else "true"
+            if args.chunk_time_interval:
+                conn.execute(
+                    text(
+                        "select create_hypertable('weather', 'time', "
+                        "chunk_time_interval => cast(:interval as interval), "
+                        f"create_default_indexes => {create_default_indexes});"
+                    ),
+                    {"interval": args.chunk_time_interval}
+                )
+            else:
+                conn.execute(text(
+                    f"select create_hypertable('weather', 'time', create_default_indexes => {create_default_indexes});"
+                ))
 
         conn.commit()
 
+    if args.precreate_chunks_hours:
+        if args.table_type != "hyper" or args.strategy != "direct":
+            print("Only hypertables have chunks to pre-create, skipping.")
+            return
+
+        timer, chunks = precreate_chunks(args.precreate_chunks_hours)
+
+        if args.benchmarks_file:
+            log_benchmark(args, "precreate_chunks", timer, chunks)
+
+    return
+
 if __name__ == "__main__":
     main(parse_args())
@@ -1,11 +1,13 @@
 import argparse
-from pathlib import Path
 
 from sqlalchemy import text
 
 from write_csv import weather_dataframe
 from timer import Timer
-from utils import get_sqlalchemy_engine, get_psycopg3_connection
+from recorder import record, check_headers, common_columns
+from server_metrics import METRICS_COLUMNS, sample_server_metrics
+from progress import PROGRESS_COLUMNS, add_progress, reporting_progress
+from utils import get_sqlalchemy_engine, get_pooled_psycopg3_connection, transaction_ranges
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -33,6 +35,40 @@ def parse_args():
         required=True
     )
 
+    parser.add_argument(
+        "--rows-per-transaction",
+        type=int,
+        help="Commit after every this many rows. By default all rows are inserted in one transaction."
+    )
+
+    parser.add_argument(
+        "--reporting-period",
+        type=str,
+        help="How often to report insert rates, e.g. 10s. Off by default."
+    )
+
+    parser.add_argument(
+        "--progress-file",
+        type=str,
+        help=(
+            "Filepath to output the reported insert rates to a CSV file like benchmarks_parallel_tpc.csv. "
+            "Reports every 10s unless --reporting-period is given."
+        )
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="Filepath to output server metrics sampled during the load to a CSV file."
+    )
+
+    parser.add_argument(
+        "--metrics-period",
+        type=float,
+        default=5,
+        help="Seconds between server metrics samples."
+    )
+
     parser.add_argument(
         "--benchmarks-file",
         type=str,
@@ -40,26 +76,46 @@ def parse_args():
         required=True
     )
     
-    return parser.parse_args()
+    args = parser.parse_args()
+
+    # Refuse results files with other columns now rather than after the load.
+    try:
+        check_headers([
+            (args.benchmarks_file, BENCHMARK_COLUMNS + common_columns()),
+            (args.progress_file, PROGRESS_COLUMNS),
+            (args.metrics_file, METRICS_COLUMNS)
+        ])
+    except ValueError as e:
+        parser.error(str(e))
+
+    return args
+
+BENCHMARK_COLUMNS = [
+    "method",
+    "table_type",
+    "num_rows",
+    "seconds",
+    "rate",
+    "units",
+    "rows_per_transaction"
+]
 
 def log_benchmark(args, timer):
-    filepath = args.benchmarks_file
-    
-    # Create file and write CSV header
-    if not Path(filepath).exists():
-        with open(filepath, "a") as file:
-            file.write("method,table_type,num_rows,seconds,rate,units\n")
-    
-    with open(filepath, "a") as file:
-        file.write(
-            f"{args.method},{args.table_type},{args.num_rows},"
-            f"{timer.interval},{timer.rate},{timer.units}\n"
-        )
-    
+    record(args.benchmarks_file, {
+        "method": args.method,
+        "table_type": args.table_type,
+        "num_rows": args.num_rows,
+        "seconds": timer.interval,
+        "rate": timer.rate,
+        "units": timer.units,
+        "rows_per_transaction": args.rows_per_transaction or args.num_rows
+    })
     return
 
 def insert_data_using_psycopg3(df, timer, args):
-    with get_psycopg3_connection() as conn, conn.cursor() as cur, timer:
+    conn, _ = get_pooled_psycopg3_connection()
+
+    with conn.cursor() as cur, timer:
         insert_query = """
             insert into weather (
                 time,
@@ -74,21 +130,23 @@ def insert_data_using_psycopg3(df, timer, args):
                 snowfall
             ) values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
-        for index, row in df.iterrows():
-            cur.execute(insert_query, (
-                row.time,
-                row.location_id,
-                row.latitude,
-                row.longitude,
-                row.temperature_2m,
-                row.zonal_wind_10m,
-                row.meridional_wind_10m,
-                row.total_cloud_cover,
-                row.total_precipitation,
-                row.snowfall
-            ))
-
-        conn.commit()
+        for start, stop in transaction_ranges(len(df.index), args.rows_per_transaction):
+            for index, row in df.iloc[start:stop].iterrows():
+                cur.execute(insert_query, (
+                    row.time,
+                    row.location_id,
+                    row.latitude,
+                    row.longitude,
+                    row.temperature_2m,
+                    row.zonal_wind_10m,
+                    row.meridional_wind_10m,
+                    row.total_cloud_cover,
+                    row.total_precipitation,
+                    row.snowfall
+                ))
+                add_progress(1)
+
+            conn.commit()
 
     return
 
@@ -121,27 +179,34 @@ def insert_data_using_sqlalchemy(df, timer, args):
                 :snowfall
             )
         """
-        for index, row in df.iterrows():
-            conn.execute(text(insert_query), {
-                "time": row.time,
-                "location_id": row.location_id,
-                "latitude": row.latitude,
-                "longitude": row.longitude,
-                "temperature_2m": row.temperature_2m,
-                "zonal_wind_10m": row.zonal_wind_10m,
-                "meridional_wind_10m": row.meridional_wind_10m,
-                "total_cloud_cover": row.total_cloud_cover,
-                "total_precipitation": row.total_precipitation,
-                "snowfall": row.snowfall
-            })
+        for start, stop in transaction_ranges(len(df.index), args.rows_per_transaction):
+            for index, row in df.iloc[start:stop].iterrows():
+                conn.execute(text(insert_query), {
+                    "time": row.time,
+                    "location_id": row.location_id,
+                    "latitude": row.latitude,
+                    "longitude": row.longitude,
+                    "temperature_2m": row.temperature_2m,
+                    "zonal_wind_10m": row.zonal_wind_10m,
+                    "meridional_wind_10m": row.meridional_wind_10m,
+                    "total_cloud_cover": row.total_cloud_cover,
+                    "total_precipitation": row.total_precipitation,
+                    "snowfall": row.snowfall
+                })
+                add_progress(1)
+
+            conn.commit()
     
     return
 
 def insert_data_using_pandas(df, timer, args):
     engine = get_sqlalchemy_engine()
 
+    # Every to_sql call runs in its own transaction.
     with timer:
-        df.to_sql("weather", engine, if_exists="append", index=False, chunksize=1)
+        for start, stop in transaction_ranges(len(df.index), args.rows_per_transaction):
+            df.iloc[start:stop].to_sql("weather", engine, if_exists="append", index=False, chunksize=1)
+            add_progress(stop - start)
     
     return
 
@@ -155,16 +220,22 @@ def main(args):
         units="inserts"
     )
 
-    if args.method == "psycopg3":
-        insert_data_using_psycopg3(df, timer, args)
-    elif args.method == "sqlalchemy":
-        insert_data_using_sqlalchemy(df, timer, args)
-    elif args.method == "pandas":
-        insert_data_using_pandas(df, timer, args)
+    progress_fields = {"method": args.method, "table_type": args.table_type, "num_workers": 1}
+
+    with reporting_progress(args.reporting_period, args.progress_file, progress_fields):
+        if args.method == "psycopg3":
+            insert_data_using_psycopg3(df, timer, args)
+        elif args.method == "sqlalchemy":
+            insert_data_using_sqlalchemy(df, timer, args)
+        elif args.method == "pandas":
+            insert_data_using_pandas(df, timer, args)
 
     log_benchmark(args, timer)
 
     return
 
 if __name__ == "__main__":
-    main(parse_args())
+    args = parse_args()
+
+    with sample_server_metrics(args.metrics_file, args.metrics_period):
+        main(args)
@@ -0,0 +1,38 @@
+# Every committed hour is recorded in load_ledger inside the same transaction as
+# its COPY. An hour is therefore in the ledger if and only if its rows are in
+# weather, and the primary key makes loading the same hour twice fail and roll back.
+CREATE_LEDGER_QUERY = """--sql
+    create table if not exists load_ledger (
+        hour int primary key,
+        num_rows bigint not null,
+        loaded_at timestamptz not null default now()
+    );
+"""
+
+DROP_LEDGER_QUERY = "drop table if exists load_ledger;"
+
+RECORD_HOUR_QUERY = "insert into load_ledger (hour, num_rows) values (%s, %s);"
+
+def ensure_ledger(conn):
+    conn.execute(CREATE_LEDGER_QUERY)
+    conn.commit()
+    return
+
+def completed_hours(conn):
+    return {hour for (hour,) in conn.execute("select hour from load_ledger;")}
+
+def record_hour(cur, n, num_rows):
+    # With an async cursor this returns the coroutine to await.
+    return cur.execute(RECORD_HOUR_QUERY, [n, num_rows])
+
+def remaining_hours(conn, hours, resume):
+    ensure_ledger(conn)
+
+    if not resume:
+        return list(hours)
+
+    done = completed_hours(conn)
+    remaining = [n for n in hours if n not in done]
+    print(f"Resuming: {len(hours) - len(remaining)} of {len(hours)} hours are already loaded.")
+
+    return remaining
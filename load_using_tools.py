@@ -1,12 +1,26 @@
 import os
 import argparse
-from pathlib import Path
 
 import dotenv
 from joblib import Parallel, delayed
 
 from timer import Timer
-from utils import sqlalchemy_connection_string, run_in_container, num_rows
+from recorder import record, check_headers, common_columns
+from server_metrics import METRICS_COLUMNS, sample_server_metrics
+from progress import ProgressCounter, ProgressReporter
+from parallel_copy import parallel_copy_file
+from parse_tpc_logs import time_to_seconds
+from chunk_routing import route_hours
+from post_load import (
+    convert_to_hypertable,
+    build_deferred_indexes,
+    compress_hypertable,
+    COMPRESSION_BENCHMARK_COLUMNS,
+    log_compression_benchmark,
+    phase_seconds,
+    print_phase_summary
+)
+from utils import sqlalchemy_connection_string, get_psycopg3_connection, run_in_container, num_rows
 
 dotenv.load_dotenv()
 
@@ -22,7 +36,7 @@ def parse_args():
 
     parser.add_argument(
         "--method",
-        choices=["pg_bulkload", "timescaledb_parallel_copy"],
+        choices=["pg_bulkload", "timescaledb_parallel_copy", "python_parallel_copy"],
         help="How to copy data into the table.",
         required=True
     )
@@ -48,6 +62,93 @@ def parse_args():
         required=True
     )
 
+    parser.add_argument(
+        "--strategy",
+        choices=["direct", "convert"],
+        default="direct",
+        help=(
+            "With --table-type hyper, load straight into a hypertable, or load a regular table "
+            "and convert it to a hypertable afterwards."
+        )
+    )
+
+    parser.add_argument(
+        "--defer-indexes",
+        action="store_true",
+        default=False,
+        help=(
+            "The hypertable was created with create_table.py --defer-indexes, so build its time index "
+            "per chunk in parallel after loading."
+        )
+    )
+
+    parser.add_argument(
+        "--maintenance-work-mem",
+        type=str,
+        help="maintenance_work_mem for the deferred index builds, e.g. 1GB."
+    )
+
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        default=False,
+        help="Enable compression on the hypertable and compress every chunk after loading."
+    )
+
+    parser.add_argument(
+        "--compress-segmentby",
+        type=str,
+        default="location_id",
+        help="Columns for timescaledb.compress_segmentby."
+    )
+
+    parser.add_argument(
+        "--compress-orderby",
+        type=str,
+        default="time desc",
+        help="Columns for timescaledb.compress_orderby."
+    )
+
+    parser.add_argument(
+        "--compression-benchmarks-file",
+        type=str,
+        help="Filepath to output compression benchmarks to a CSV file."
+    )
+
+    parser.add_argument(
+        "--routing",
+        choices=["round_robin", "chunk"],
+        default="round_robin",
+        help="For pg_bulkload, hand hours to workers as they free up, or give each worker a disjoint set of hypertable chunks."
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=10000,
+        help="Number of rows per COPY batch, and so per transaction, for timescaledb_parallel_copy and python_parallel_copy."
+    )
+
+    parser.add_argument(
+        "--reporting-period",
+        type=str,
+        default="10s",
+        help="How often to report insert rates for timescaledb_parallel_copy and python_parallel_copy, e.g. 10s."
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="Filepath to output server metrics sampled during the load to a CSV file."
+    )
+
+    parser.add_argument(
+        "--metrics-period",
+        type=float,
+        default=5,
+        help="Seconds between server metrics samples."
+    )
+
     parser.add_argument(
         "--benchmarks-file",
         type=str,
@@ -61,44 +162,92 @@ def parse_args():
         help="Filepath to output parallel benchmarks to a CSV file."
     )
 
-    return parser.parse_args()
+    args = parser.parse_args()
+
+    # Refuse results files with other columns now rather than after the load.
+    try:
+        check_headers([
+            (args.benchmarks_file, BENCHMARK_COLUMNS + common_columns()),
+            (args.parallel_benchmarks_file, PARALLEL_BENCHMARK_COLUMNS + common_columns()),
+            (args.compression_benchmarks_file, COMPRESSION_BENCHMARK_COLUMNS + common_columns()),
+            (args.metrics_file, METRICS_COLUMNS)
+        ])
+    except ValueError as e:
+        parser.error(str(e))
+
+    return args
+
+BENCHMARK_COLUMNS = [
+    "method",
+    "table_type",
+    "workers",
+    "hour",
+    "num_rows",
+    "seconds",
+    "rate",
+    "units"
+]
 
 def log_benchmark(args, timer, hour):
-    filepath = args.benchmarks_file
-    
-    # Create file and write CSV header
-    if not Path(filepath).exists():
-        with open(filepath, "a") as file:
-            file.write(
-                "method,table_type,workers,hour,num_rows,"
-                "seconds,rate,units\n"
-            )
-    
-    with open(filepath, "a") as file:
-        file.write(
-            f"{args.method},{args.table_type},{args.workers},{hour},{num_rows(1)},"
-            f"{timer.interval},{timer.rate},{timer.units}\n"
-        )
-    
+    record(args.benchmarks_file, {
+        "method": args.method,
+        "table_type": args.table_type,
+        "workers": args.workers,
+        "hour": hour,
+        "num_rows": num_rows(1),
+        "seconds": timer.interval,
+        "rate": timer.rate,
+        "units": timer.units
+    })
     return
 
-def log_parallel_benchmark(args, timer):
-    filepath = args.parallel_benchmarks_file
-    
-    # Create file and write CSV header
-    if not Path(filepath).exists():
-        with open(filepath, "a") as file:
-            file.write(
-                "method,table_type,workers,hours,num_rows,"
-                "seconds,rate,units\n"
-            )
-    
-    with open(filepath, "a") as file:
-        file.write(
-            f"{args.method},{args.table_type},{args.workers},{args.hours},{num_rows(args.hours)},"
-            f"{timer.interval},{timer.rate},{timer.units}\n"
-        )
-    
+def rows_per_transaction(args):
+    # Both parallel COPY tools commit every batch. pg_bulkload bypasses the
+    # usual transaction machinery, so it has no transaction size.
+    if args.method == "pg_bulkload":
+        return ""
+    return args.batch_size
+
+PARALLEL_BENCHMARK_COLUMNS = [
+    "method",
+    "table_type",
+    "workers",
+    "hours",
+    "num_rows",
+    "seconds",
+    "rate",
+    "units",
+    "routing",
+    "chunks",
+    "shared_chunks",
+    "max_workers_per_chunk",
+    "strategy",
+    "seconds_set_logged",
+    "seconds_convert",
+    "seconds_index",
+    "rows_per_transaction"
+]
+
+def log_parallel_benchmark(args, timer, routing_stats, post_load_timers):
+    record(args.parallel_benchmarks_file, {
+        "method": args.method,
+        "table_type": args.table_type,
+        "workers": args.workers,
+        "hours": args.hours,
+        "num_rows": num_rows(args.hours),
+        "seconds": timer.interval,
+        "rate": timer.rate,
+        "units": timer.units,
+        "routing": args.routing,
+        "chunks": routing_stats.get("chunks", ""),
+        "shared_chunks": routing_stats.get("shared_chunks", ""),
+        "max_workers_per_chunk": routing_stats.get("max_workers_per_chunk", ""),
+        "strategy": args.strategy,
+        "seconds_set_logged": phase_seconds(post_load_timers, "set_logged"),
+        "seconds_convert": phase_seconds(post_load_timers, "convert"),
+        "seconds_index": phase_seconds(post_load_timers, "index"),
+        "rows_per_transaction": rows_per_transaction(args)
+    })
     return
 
 def _pg_bulkload(args, n):
@@ -125,7 +274,12 @@ def _pg_bulkload(args, n):
 
     return
 
-def load_data_using_pg_bulkload(args):
+def _pg_bulkload_hours(args, hours):
+    for n in hours:
+        _pg_bulkload(args, n)
+    return
+
+def load_data_using_pg_bulkload(args, assignment):
     run_in_container([
         "psql",
         "-U", POSTGRES_USER,
@@ -133,10 +287,16 @@ def load_data_using_pg_bulkload(args):
         "-c", "CREATE EXTENSION if not exists pg_bulkload;"
     ])
 
-    Parallel(n_jobs=args.workers)(
-        delayed(_pg_bulkload)(args, n)
-        for n in range(args.hours)
-    )
+    if args.routing == "chunk":
+        Parallel(n_jobs=args.workers)(
+            delayed(_pg_bulkload_hours)(args, hours)
+            for hours in assignment if hours
+        )
+    else:
+        Parallel(n_jobs=args.workers)(
+            delayed(_pg_bulkload)(args, n)
+            for n in range(args.hours)
+        )
 
     return
 
@@ -151,10 +311,10 @@ def load_data_using_tpc(args):
         cmd = [
             "timescaledb-parallel-copy",
             "--verbose",
-            "--reporting-period", "10s",
+            "--reporting-period", args.reporting_period,
             "--connection", sqlalchemy_connection_string(),
             "--table", "weather",
-            "--batch-size", "10000",
+            "--batch-size", f"{args.batch_size}",
             "--workers", f"{args.workers}",
             "--file", f"{CSV_PATH}/weather_hour{n}.csv"
         ]
@@ -166,6 +326,33 @@ def load_data_using_tpc(args):
     
     return
 
+def load_data_using_python_parallel_copy(args):
+    # A native stand-in for timescaledb-parallel-copy that needs no container.
+    # Its progress lines match tpc's so parse_tpc_logs.py can parse them.
+    connections = [get_psycopg3_connection() for _ in range(args.workers)]
+    counter = ProgressCounter()
+
+    try:
+        with ProgressReporter(counter, time_to_seconds(args.reporting_period)) as reporter:
+            for n in range(args.hours):
+                timer = Timer(
+                    f"COPYing hour {n} using {args.method} with {args.workers} workers",
+                    n=num_rows(1),
+                    units="inserts"
+                )
+
+                with timer:
+                    parallel_copy_file(f"{CSV_PATH}/weather_hour{n}.csv", connections, args.batch_size, counter)
+
+                log_benchmark(args, timer, n)
+
+        print(reporter.summary(args.workers), flush=True)
+    finally:
+        for conn in connections:
+            conn.close()
+
+    return
+
 def main(args):
     timer = Timer(
         f"COPYing {args.hours} hours of data using {args.method} "
@@ -174,16 +361,45 @@ def main(args):
         units="inserts"
     )
 
+    assignment, routing_stats = None, {}
+    if args.method == "pg_bulkload" and args.workers > 1 and (args.table_type == "hyper" or args.routing == "chunk"):
+        assignment, routing_stats = route_hours(range(args.hours), args.workers, args.routing)
+
     with timer:
         if args.method == "pg_bulkload":
-            load_data_using_pg_bulkload(args)
+            load_data_using_pg_bulkload(args, assignment)
         elif args.method == "timescaledb_parallel_copy":
             load_data_using_tpc(args)
+        elif args.method == "python_parallel_copy":
+            load_data_using_python_parallel_copy(args)
+
+    post_load_timers = {}
+    if args.table_type == "hyper" and args.strategy == "convert":
+        post_load_timers.update(convert_to_hypertable(args.hours, create_default_indexes=not args.defer_indexes))
+
+    if args.table_type == "hyper" and args.defer_indexes:
+        post_load_timers["index"] = build_deferred_indexes(args.workers, args.maintenance_work_mem)
+
+    if args.compress:
+        if args.table_type != "hyper":
+            print("Only hypertables can be compressed, skipping compression.")
+        else:
+            post_load_timers["compress"], compression_stats = compress_hypertable(
+                args.workers, args.compress_segmentby, args.compress_orderby
+            )
+            if args.compression_benchmarks_file:
+                log_compression_benchmark(args, args.hours, args.workers, post_load_timers["compress"], compression_stats)
+
+    if post_load_timers:
+        print_phase_summary(timer, post_load_timers)
 
     if args.parallel_benchmarks_file:
-        log_parallel_benchmark(args, timer)
+        log_parallel_benchmark(args, timer, routing_stats, post_load_timers)
 
     return
 
 if __name__ == "__main__":
-    main(parse_args())
+    args = parse_args()
+
+    with sample_server_metrics(args.metrics_file, args.metrics_period):
+        main(args)
@@ -1,11 +1,13 @@
 import argparse
-from pathlib import Path
 
 from sqlalchemy import text
 
 from write_csv import weather_dataframe
 from timer import Timer
-from utils import get_sqlalchemy_engine, get_psycopg3_connection
+from recorder import record, check_headers, common_columns
+from server_metrics import METRICS_COLUMNS, sample_server_metrics
+from progress import PROGRESS_COLUMNS, add_progress, reporting_progress
+from utils import get_sqlalchemy_engine, get_psycopg3_connection, transaction_ranges
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -33,6 +35,40 @@ def parse_args():
         required=True
     )
 
+    parser.add_argument(
+        "--rows-per-transaction",
+        type=int,
+        help="Commit after every this many rows. By default all rows are inserted in one transaction."
+    )
+
+    parser.add_argument(
+        "--reporting-period",
+        type=str,
+        help="How often to report insert rates, e.g. 10s. Off by default."
+    )
+
+    parser.add_argument(
+        "--progress-file",
+        type=str,
+        help=(
+            "Filepath to output the reported insert rates to a CSV file like benchmarks_parallel_tpc.csv. "
+            "Reports every 10s unless --reporting-period is given."
+        )
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="Filepath to output server metrics sampled during the load to a CSV file."
+    )
+
+    parser.add_argument(
+        "--metrics-period",
+        type=float,
+        default=5,
+        help="Seconds between server metrics samples."
+    )
+
     parser.add_argument(
         "--benchmarks-file",
         type=str,
@@ -40,22 +76,40 @@ def parse_args():
         required=True
     )
     
-    return parser.parse_args()
+    args = parser.parse_args()
+
+    # Refuse results files with other columns now rather than after the load.
+    try:
+        check_headers([
+            (args.benchmarks_file, BENCHMARK_COLUMNS + common_columns()),
+            (args.progress_file, PROGRESS_COLUMNS),
+            (args.metrics_file, METRICS_COLUMNS)
+        ])
+    except ValueError as e:
+        parser.error(str(e))
+
+    return args
+
+BENCHMARK_COLUMNS = [
+    "method",
+    "table_type",
+    "num_rows",
+    "seconds",
+    "rate",
+    "units",
+    "rows_per_transaction"
+]
 
 def log_benchmark(args, timer):
-    filepath = args.benchmarks_file
-    
-    # Create file and write CSV header
-    if not Path(filepath).exists():
-        with open(filepath, "a") as file:
-            file.write("method,table_type,num_rows,seconds,rate,units\n")
-    
-    with open(filepath, "a") as file:
-        file.write(
-            f"{args.method},{args.table_type},{args.num_rows},"
-            f"{timer.interval},{timer.rate},{timer.units}\n"
-        )
-    
+    record(args.benchmarks_file, {
+        "method": args.method,
+        "table_type": args.table_type,
+        "num_rows": args.num_rows,
+        "seconds": timer.interval,
+        "rate": timer.rate,
+        "units": timer.units,
+        "rows_per_transaction": args.rows_per_transaction or args.num_rows
+    })
     return
 
 def batch_insert_data_using_psycopg3(df, timer, args):
@@ -79,8 +133,10 @@ def batch_insert_data_using_psycopg3(df, timer, args):
             # for row in df.itertuples(index=False):
             #     data_tuples.append(tuple(row))
 
-        cur.executemany(insert_query, data_tuples)
-        conn.commit()
+        for start, stop in transaction_ranges(len(data_tuples), args.rows_per_transaction):
+            cur.executemany(insert_query, data_tuples[start:stop])
+            conn.commit()
+            add_progress(stop - start)
 
     return
 
@@ -116,15 +172,21 @@ def batch_insert_data_using_sqlalchemy(df, timer, args):
         with Timer("Constructing data dicts"):
             data_dicts = df.to_dict("records")
         
-        conn.execute(text(insert_query), data_dicts)
+        for start, stop in transaction_ranges(len(data_dicts), args.rows_per_transaction):
+            conn.execute(text(insert_query), data_dicts[start:stop])
+            conn.commit()
+            add_progress(stop - start)
     
     return
 
 def batch_insert_data_using_pandas(df, timer, args):
     engine = get_sqlalchemy_engine()
 
+    # Every to_sql call runs in its own transaction.
     with timer:
-        df.to_sql("weather", engine, if_exists="append", index=False, method="multi", chunksize=1000)
+        for start, stop in transaction_ranges(len(df.index), args.rows_per_transaction):
+            df.iloc[start:stop].to_sql("weather", engine, if_exists="append", index=False, method="multi", chunksize=1000)
+            add_progress(stop - start)
     
     return
 
@@ -138,16 +200,22 @@ def main(args):
         units="inserts"
     )
 
-    if args.method == "psycopg3":
-        batch_insert_data_using_psycopg3(df, timer, args)
-    elif args.method == "sqlalchemy":
-        batch_insert_data_using_sqlalchemy(df, timer, args)
-    elif args.method == "pandas":
-        batch_insert_data_using_pandas(df, timer, args)
+    progress_fields = {"method": args.method, "table_type": args.table_type, "num_workers": 1}
+
+    with reporting_progress(args.reporting_period, args.progress_file, progress_fields):
+        if args.method == "psycopg3":
+            batch_insert_data_using_psycopg3(df, timer, args)
+        elif args.method == "sqlalchemy":
+            batch_insert_data_using_sqlalchemy(df, timer, args)
+        elif args.method == "pandas":
+            batch_insert_data_using_pandas(df, timer, args)
 
     log_benchmark(args, timer)
 
     return
 
 if __name__ == "__main__":
-    main(parse_args())
\ No newline at end of file
+    args = parse_args()
+
+    with sample_server_metrics(args.metrics_file, args.metrics_period):
+        main(args)
\ No newline at end of file
@@ -0,0 +1,82 @@
+import mmap
+import queue
+import threading
+
+import numpy as np
+
+from copy_encoders import copy_statement
+
+# Scan for newlines in windows so the boolean mask never spans the whole file.
+NEWLINE_SCAN_BYTES = 64 * 1024**2
+
+def line_batches(buffer, batch_size):
+    # Split a buffer of CSV lines into (start, stop, num_rows) byte ranges of
+    # batch_size lines each, always cutting just after a newline.
+    data = np.frombuffer(buffer, dtype=np.uint8)
+
+    line_ends = np.concatenate([
+        np.flatnonzero(data[start:start + NEWLINE_SCAN_BYTES] == ord("\n")) + start + 1
+        for start in range(0, len(data), NEWLINE_SCAN_BYTES)
+    ] or [np.empty(0, dtype=np.int64)])
+
+    # A final line without a trailing newline still counts as a row.
+    if len(data) and data[-1] != ord("\n"):
+        line_ends = np.append(line_ends, len(data))
+
+    stops = line_ends[batch_size - 1::batch_size].tolist()
+    if len(line_ends) and (not stops or stops[-1] != line_ends[-1]):
+        stops.append(int(line_ends[-1]))
+
+    batches = []
+    start, rows_so_far = 0, 0
+    for stop in stops:
+        num_rows = min(batch_size, len(line_ends) - rows_so_far)
+        batches.append((start, stop, num_rows))
+        start, rows_so_far = stop, rows_so_far + num_rows
+
+    return batches
+
+def copy_batches(conn, buffer, batches, counter):
+    # Like timescaledb-parallel-copy, every batch is its own COPY and transaction.
+    while True:
+        try:
+            start, stop, num_rows = batches.get_nowait()
+        except queue.Empty:
+            break
+
+        with conn.cursor() as cur:
+            with cur.copy(copy_statement("csv")) as copy, buffer[start:stop] as batch:
+                copy.write(batch)
+        conn.commit()
+
+        counter.add(num_rows)
+
+    return
+
+def parallel_copy_file(filepath, connections, batch_size, counter):
+    # COPY a CSV file over all connections at once, one thread per connection.
+    # psycopg releases the GIL while it waits on the network.
+    with open(filepath, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as buffer:
+            batches = queue.Queue()
+            for batch in line_batches(buffer, batch_size):
+                batches.put(batch)
+
+            errors = []
+
+            def work(conn):
+                try:
+                    copy_batches(conn, buffer, batches, counter)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=work, args=(conn,)) for conn in connections]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return
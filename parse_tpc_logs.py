@@ -1,7 +1,8 @@
 import re
-import csv
 from pathlib import Path
 
+from recorder import append_rows
+
 # Convert e.g. "12m30s" to 750
 def time_to_seconds(time_str):    
     match = re.match(r"(\d+)m(\d+(\.\d+)?)s", time_str)
@@ -10,8 +11,13 @@ def time_to_seconds(time_str):
         return int(minutes) * 60 + float(seconds)
     
     match = re.match(r"(\d+)s", time_str)
-    if match:
+    if match and match.group(0) == time_str:
         return int(match.group(1))
+
+    # Runs shorter than a minute end with e.g. "took 5.123457s".
+    match = re.match(r"(\d+\.\d+)s", time_str)
+    if match:
+        return float(match.group(1))
     
     raise ValueError(f"Invalid time_str: {time_str}") 
 
@@ -22,60 +28,62 @@ def parse_filename(filename):
         return match.group(1), match.group(2)
     raise ValueError(f"Invalid filename: {filename}")
 
-def parse_log_file(log_filepath, output_csv_path=Path("benchmarks_parallel_tpc.csv")):
+# Logs written through load_using_tools.py name the method in its timer lines,
+# e.g. "COPYing hour 0 using python_parallel_copy with 4 workers".
+def parse_method(log_filepath):
+    with open(log_filepath, "r") as file:
+        for line in file:
+            match = re.search(r"using (\w+) with \d+ workers", line)
+            if match:
+                return match.group(1)
+    # Raw output of timescaledb-parallel-copy itself.
+    return "timescaledb_parallel_copy"
+
+def parse_log_file(log_filepath, output_csv_path=Path("benchmarks_parallel_tpc.csv"), method=None):
     table_type, num_workers = parse_filename(log_filepath)
+    method = method or parse_method(log_filepath)
+    rows = []
 
-    with open(output_csv_path, mode="a", newline="") as csv_file:
-        csv_writer = csv.writer(csv_file)
+    with open(log_filepath, "r") as file:
+        for line in file:
+            main_log_match = re.search(
+                r"at ([\dms]+), "
+                r"row rate ([\d\.]+)/sec \(period\), "
+                r"row rate ([\d\.]+)/sec \(overall\), "
+                r"([\d\.E\+]+) total rows",
+                line
+            )
 
-        if not output_csv_path.exists() or output_csv_path.stat().st_size == 0:
-            csv_writer.writerow([
-                "table_type",
-                "num_workers",
-                "time",
-                "period_rate",
-                "overall_rate",
-                "total_rows"
-            ])
-    
-        with open(log_filepath, "r") as file:
-            for line in file:
-                main_log_match = re.search(
-                    r"at ([\dms]+), "
-                    r"row rate ([\d\.]+)/sec \(period\), "
-                    r"row rate ([\d\.]+)/sec \(overall\), "
-                    r"([\d\.E\+]+) total rows",
-                    line
-                )
+            last_line_match = re.search(
+                r"COPY (\d+), "
+                r"took ([\dms\.]+) "
+                r"with (\d+) worker\(s\) "
+                r"\(mean rate ([\d\.]+)/sec\)",
+                line
+            )
+
+            if main_log_match:
+                time_str, period_rate, overall_rate, total_rows = main_log_match.groups()
+            elif last_line_match:
+                total_rows, time_str, _, overall_rate = last_line_match.groups()
+                period_rate = overall_rate
+            else:
+                continue
 
-                last_line_match = re.search(
-                    r"COPY (\d+), "
-                    r"took ([\dms\.]+) "
-                    r"with (\d+) worker\(s\) "
-                    r"\(mean rate ([\d\.]+)/sec\)",
-                    line
-                )
+            rows.append({
+                "method": method,
+                "table_type": table_type,
+                "num_workers": num_workers,
+                "time": time_to_seconds(time_str),
+                "period_rate": period_rate,
+                "overall_rate": overall_rate,
+                "total_rows": int(float(total_rows))
+            })
 
-                if main_log_match:
-                    time_str, period_rate, overall_rate, total_rows = main_log_match.groups()
-                    csv_writer.writerow([
-                        table_type,
-                        num_workers,
-                        time_to_seconds(time_str),
-                        period_rate,
-                        overall_rate,
-                        int(float(total_rows))
-                    ])
-                elif last_line_match:
-                    total_rows, time_str, _, overall_rate = last_line_match.groups()
-                    csv_writer.writerow([
-                        table_type,
-                        num_workers,
-                        time_to_seconds(time_str),
-                        overall_rate,
-                        overall_rate,
-                        int(float(total_rows))
-                    ])
+    # Same columns as the rows copy_data.py --progress-file writes, and refuses
+    # files with other columns, e.g. ones parsed before the method column.
+    if rows:
+        append_rows(output_csv_path, rows)
 
 if __name__ == "__main__":
     for table_type in ["regular", "hyper"]:
@@ -1,10 +1,42 @@
+import argparse
+
 import numpy as np
+import pandas as pd
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 
-t_regular = 1920.3047
-t_hypertable = 3105.8773
-t_conversion = 1868.793172
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Plot load time into a hypertable versus loading a regular table and converting it."
+    )
+
+    parser.add_argument(
+        "--benchmarks-file",
+        type=str,
+        help="Filepath to a parallel benchmarks CSV file with --strategy direct and convert runs.",
+        required=True
+    )
+
+    parser.add_argument(
+        "--method",
+        type=str,
+        help="Only compare runs that used this loading method."
+    )
+
+    return parser.parse_args()
+
+args = parse_args()
+
+df = pd.read_csv(args.benchmarks_file).query("table_type == 'hyper'")
+if args.method:
+    df = df.query(f"method == '{args.method}'")
+
+direct = df.query("strategy == 'direct'")
+convert = df.query("strategy == 'convert'")
+
+t_regular = convert["seconds"].median()
+t_hypertable = direct["seconds"].median()
+t_conversion = (convert["seconds_set_logged"] + convert["seconds_convert"]).median()
 
 benchmark_times = {
     "regular → hypertable": t_regular,
@@ -33,7 +65,7 @@ ax.set_ylabel("Wall clock time (minutes)")
 bars = ax.bar(ghost.keys(), ghost.values(), alpha=0)
 ax.bar_label(bars, fmt=lambda x: f"{x/60:.0f} mins")
 
-ax.set_yticks(60 * np.array([0, 10, 20, 30, 40, 50, 60, 70]))
+ax.set_yticks(60 * np.arange(0, max(ghost.values()) / 60 + 10, 10))
 ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda x, _: f"{x/60:.0f}"))
 
 ax.legend(frameon=False)
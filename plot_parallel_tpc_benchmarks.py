@@ -14,9 +14,19 @@ def parse_args():
     parser.add_argument(
         "--benchmarks-file",
         type=str,
-        help="Filepath to a benchmarks CSV file generated by parse_tpc_logs.py.",
+        help=(
+            "Filepath to a benchmarks CSV file generated by parse_tpc_logs.py or by the "
+            "--progress-file option of copy_data.py, insert_data.py and multi_insert_data.py."
+        ),
         required=True
     )
+
+    parser.add_argument(
+        "--method",
+        type=str,
+        default="timescaledb_parallel_copy",
+        help="Which method's insert rates to plot, e.g. psycopg3_binary."
+    )
     
     return parser.parse_args()
 
@@ -54,9 +64,13 @@ def get_color(num_workers):
         return "darkorange"
     elif num_workers == 32:
         return "orangered"
+    elif num_workers == "auto":
+        return "purple"
 
 def plot(df, ax, table_type, num_workers, rate):
-    dfq = df.query(f"table_type == '{table_type}' and num_workers == {num_workers}").sort_values(by="total_rows")
+    dfq = df[(df["table_type"] == table_type) & (df["num_workers"].astype(str) == str(num_workers))].sort_values(by="total_rows")
+    if dfq.empty:
+        return
     rows_inserted = dfq["total_rows"] / 1e6
     insert_rate = dfq[rate]
     ax.plot(
@@ -78,10 +92,15 @@ def num_to_kM(val, pos):
 def main(args):
     df = pd.read_csv(args.benchmarks_file)
 
+    # Files parsed from tpc logs before the method column was added.
+    if "method" not in df.columns:
+        df["method"] = "timescaledb_parallel_copy"
+    df = df[df["method"] == args.method]
+
     fig, ax = plt.subplots(figsize=(8, 6))
 
     for table_type in ["regular", "hyper"]:
-        for n in [1, 2, 4, 8, 16, 32]:
+        for n in [1, 2, 4, 8, 16, 32, "auto"]:
             plot(df, ax, table_type, n, "overall_rate")
 
     ax.set_yscale("log")
@@ -94,6 +113,8 @@ def main(args):
     ax.legend(frameon=False, ncol=2, loc="upper center", bbox_to_anchor=(0.5, 1.3))
     
     output_filename = Path(args.benchmarks_file).with_suffix(".png")
+    if args.method != "timescaledb_parallel_copy":
+        output_filename = output_filename.with_stem(f"{output_filename.stem}_{args.method}")
     fig.savefig(output_filename, dpi=200, transparent=False, bbox_inches="tight")
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+from psycopg import sql
+from joblib import Parallel, delayed
+
+from timer import Timer
+from recorder import record
+from utils import get_psycopg3_connection, num_rows
+
+def is_unlogged(conn, table="weather"):
+    (persistence,) = conn.execute(
+        "select relpersistence from pg_class where oid = %s::regclass;", [table]
+    ).fetchone()
+    return persistence == "u"
+
+def convert_to_hypertable(hours, create_default_indexes=True):
+    # Turn a regular table loaded with --strategy convert into a hypertable,
+    # first making it logged again if it was created with --unlogged.
+    timers = {}
+
+    with get_psycopg3_connection() as conn:
+        if is_unlogged(conn):
+            timers["set_logged"] = Timer("Setting the weather table to logged", n=num_rows(hours), units="rows")
+            with timers["set_logged"]:
+                conn.execute("alter table weather set logged;")
+                conn.commit()
+
+        timers["convert"] = Timer("Converting the weather table to a hypertable", n=num_rows(hours), units="rows")
+        with timers["convert"]:
+            conn.execute(
+                "select create_hypertable('weather', 'time', migrate_data => true, create_default_indexes => %s);",
+                [create_default_indexes]
+            )
+            conn.commit()
+
+    return timers
+
+def hypertable_chunks(conn):
+    return [chunk for (chunk,) in conn.execute("select show_chunks('weather')::text;")]
+
+def build_chunk_index(chunk, maintenance_work_mem):
+    # Same name TimescaleDB gives the default index on a chunk.
+    index_name = chunk.split(".")[-1].strip('"') + "_weather_time_idx"
+
+    with get_psycopg3_connection() as conn:
+        if maintenance_work_mem:
+            conn.execute("select set_config('maintenance_work_mem', %s, false);", [maintenance_work_mem])
+        conn.execute(f'create index if not exists "{index_name}" on {chunk} (time desc);')
+        conn.commit()
+
+    return
+
+def build_deferred_indexes(workers, maintenance_work_mem=None):
+    # Build the time index that create_hypertable would have created, one chunk per
+    # connection with up to `workers` chunks at once. The indexes only exist on
+    # the chunks, not on the hypertable, so chunks created later get none. That
+    # is fine for a one-off bulk load benchmark.
+    with get_psycopg3_connection() as conn:
+        chunks = hypertable_chunks(conn)
+
+    timer = Timer(f"Building time indexes on {len(chunks)} chunks with {workers} workers")
+
+    with timer:
+        Parallel(n_jobs=workers, prefer="threads")(
+            delayed(build_chunk_index)(chunk, maintenance_work_mem)
+            for chunk in chunks
+        )
+
+    return timer
+
+def hypertable_size(conn):
+    (size,) = conn.execute("select hypertable_size('weather');").fetchone()
+    return size
+
+def compress_chunk(chunk):
+    with get_psycopg3_connection() as conn:
+        conn.execute("select compress_chunk(%s::regclass, if_not_compressed => true);", [chunk])
+        conn.commit()
+    return
+
+def compress_hypertable(workers, segmentby, orderby):
+    with get_psycopg3_connection() as conn:
+        # ALTER TABLE cannot take bind parameters, so quote the settings as literals.
+        conn.execute(sql.SQL("""--sql
+            alter table weather set (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = {segmentby},
+                timescaledb.compress_orderby = {orderby}
+            );
+        """).format(segmentby=sql.Literal(segmentby), orderby=sql.Literal(orderby)))
+        conn.commit()
+
+        chunks = hypertable_chunks(conn)
+        bytes_before = hypertable_size(conn)
+        # Every chunk is compressed, including hours loaded before a --resume.
+        (rows,) = conn.execute("select count(*) from weather;").fetchone()
+
+    timer = Timer(
+        f"Compressing {len(chunks)} chunks with {workers} workers",
+        n=rows,
+        units="rows"
+    )
+
+    with timer:
+        Parallel(n_jobs=workers, prefer="threads")(
+            delayed(compress_chunk)(chunk)
+            for chunk in chunks
+        )
+
+    with get_psycopg3_connection() as conn:
+        bytes_after = hypertable_size(conn)
+
+    print(
+        f"Compressed weather from {bytes_before / 1024**3:.2f} GiB to {bytes_after / 1024**3:.2f} GiB "
+        f"({bytes_before / bytes_after:.2f}x)."
+    )
+
+    return timer, {"chunks": len(chunks), "num_rows": rows, "bytes_before": bytes_before, "bytes_after": bytes_after}
+
+COMPRESSION_BENCHMARK_COLUMNS = [
+    "method",
+    "table_type",
+    "workers",
+    "hours",
+    "num_rows",
+    "chunks",
+    "segmentby",
+    "orderby",
+    "seconds",
+    "rate",
+    "units",
+    "bytes_before",
+    "bytes_after",
+    "compression_ratio"
+]
+
+def log_compression_benchmark(args, hours, workers, timer, stats):
+    record(args.compression_benchmarks_file, {
+        "method": args.method,
+        "table_type": args.table_type,
+        "workers": workers,
+        "hours": hours,
+        "num_rows": stats["num_rows"],
+        "chunks": stats["chunks"],
+        "segmentby": args.compress_segmentby,
+        "orderby": args.compress_orderby,
+        "seconds": timer.interval,
+        "rate": timer.rate,
+        "units": timer.units,
+        "bytes_before": stats["bytes_before"],
+        "bytes_after": stats["bytes_after"],
+        "compression_ratio": stats["bytes_before"] / stats["bytes_after"]
+    })
+    return
+
+def phase_seconds(timers, phase):
+    return timers[phase].interval if phase in timers else 0
+
+def print_phase_summary(load_timer, post_load_timers):
+    total = load_timer.interval + sum(timer.interval for timer in post_load_timers.values())
+    phases = " + ".join(
+        f"{phase} {timer.interval:.4f}"
+        for phase, timer in {"load": load_timer, **post_load_timers}.items()
+    )
+    print(f"Load and post-load phases: {phases} = {total:.4f} seconds.")
+    return
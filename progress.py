@@ -0,0 +1,190 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import contextlib
+
+from recorder import append_rows
+from parse_tpc_logs import time_to_seconds
+
+# Durations are printed like Go's time.Duration, e.g. "10s" or "18m3.177578s",
+# to match timescaledb-parallel-copy's output parsed by parse_tpc_logs.py.
+def format_duration(seconds, precise=False):
+    minutes, seconds = divmod(seconds, 60)
+    seconds = f"{seconds:.6f}".rstrip("0").rstrip(".") if precise else f"{seconds:.0f}"
+    if minutes:
+        return f"{minutes:.0f}m{seconds}s"
+    return f"{seconds}s"
+
+class ProgressCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+
+    def add(self, rows):
+        with self.lock:
+            self.total += rows
+
+    def value(self):
+        with self.lock:
+            return self.total
+
+# Rows this process has added with add_progress, see SharedProgressCounter.
+_process_rows = 0
+_process_rows_pid = os.getpid()
+_process_rows_lock = threading.Lock()
+
+def _reset_process_rows_lock():
+    # A worker forked while the reporter thread held the lock would otherwise
+    # never be able to take it.
+    global _process_rows_lock
+    _process_rows_lock = threading.Lock()
+    return
+
+os.register_at_fork(after_in_child=_reset_process_rows_lock)
+
+def process_rows(add=0):
+    # Forked workers start with their parent's count, which the parent already
+    # reports, so start afresh in every new process.
+    global _process_rows, _process_rows_pid
+    with _process_rows_lock:
+        if _process_rows_pid != os.getpid():
+            _process_rows = 0
+            _process_rows_pid = os.getpid()
+        _process_rows += add
+        return _process_rows
+
+def add_progress(rows):
+    # A no-op unless a SharedProgressCounter is counting. Worker processes keep
+    # their running total in their own file under PROGRESS_PATH for the
+    # reporting process to sum.
+    path = os.environ.get("PROGRESS_PATH")
+    if not path:
+        return
+
+    total = process_rows(rows)
+
+    if os.environ.get("PROGRESS_PID") != str(os.getpid()):
+        filepath = os.path.join(path, f"rows_{os.getpid()}")
+        tmp_filepath = f"{filepath}.tmp"
+        with open(tmp_filepath, "w") as file:
+            file.write(str(total))
+        os.replace(tmp_filepath, filepath)
+
+    return
+
+class SharedProgressCounter:
+    # Counts the rows added with add_progress by this process and by every
+    # worker process it starts from now on, forked or spawned, which inherit
+    # PROGRESS_PATH from the environment.
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix="progress_")
+        self.start_rows = process_rows()
+        os.environ["PROGRESS_PATH"] = self.path
+        os.environ["PROGRESS_PID"] = str(os.getpid())
+
+    def value(self):
+        total = process_rows() - self.start_rows
+        for filename in os.listdir(self.path):
+            if not filename.endswith(".tmp"):
+                with open(os.path.join(self.path, filename)) as file:
+                    total += int(file.read())
+        return total
+
+    def close(self):
+        del os.environ["PROGRESS_PATH"]
+        del os.environ["PROGRESS_PID"]
+        shutil.rmtree(self.path, ignore_errors=True)
+
+# The columns of benchmarks_parallel_tpc.csv, see parse_tpc_logs.py.
+PROGRESS_COLUMNS = [
+    "method",
+    "table_type",
+    "num_workers",
+    "time",
+    "period_rate",
+    "overall_rate",
+    "total_rows"
+]
+
+class ProgressReporter:
+    # With a filepath, every progress line is also appended as a row in the
+    # schema of benchmarks_parallel_tpc.csv, see parse_tpc_logs.py, after the
+    # given fields, e.g. method, table_type and num_workers.
+    def __init__(self, counter, period, filepath=None, fields=None):
+        self.counter = counter
+        self.period = period
+        self.filepath = filepath
+        self.fields = fields or {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+        self.elapsed = time.perf_counter() - self.start
+
+        # Like the final line of tpc's log, the whole run at its mean rate.
+        rows = self.counter.value()
+        self.write(self.elapsed, rows / self.elapsed, rows / self.elapsed, rows)
+
+    def write(self, seconds, period_rate, overall_rate, rows):
+        if self.filepath:
+            append_rows(self.filepath, [{
+                **self.fields,
+                "time": seconds,
+                "period_rate": period_rate,
+                "overall_rate": overall_rate,
+                "total_rows": rows
+            }])
+
+    def run(self):
+        previous_rows = 0
+        tick = 1
+
+        while not self.stopped.wait(self.start + tick * self.period - time.perf_counter()):
+            rows = self.counter.value()
+            period_rate = (rows - previous_rows) / self.period
+            overall_rate = rows / (tick * self.period)
+
+            print(
+                f"at {format_duration(tick * self.period)}, "
+                f"row rate {period_rate:.2f}/sec (period), "
+                f"row rate {overall_rate:.2f}/sec (overall), "
+                f"{rows:E} total rows",
+                flush=True
+            )
+            self.write(tick * self.period, period_rate, overall_rate, rows)
+
+            previous_rows = rows
+            tick += 1
+
+    def summary(self, workers):
+        rows = self.counter.value()
+        return (
+            f"COPY {rows}, took {format_duration(self.elapsed, precise=True)} "
+            f"with {workers} worker(s) (mean rate {rows / self.elapsed:.6f}/sec)"
+        )
+
+@contextlib.contextmanager
+def reporting_progress(period, filepath, fields):
+    # Report the rows added with add_progress every period, e.g. "10s", in the
+    # format of tpc's log. fields are method, table_type and num_workers. Off
+    # unless a period or a filepath is given.
+    if not period and not filepath:
+        yield
+        return
+
+    counter = SharedProgressCounter()
+    try:
+        with ProgressReporter(counter, time_to_seconds(period or "10s"), filepath, fields) as reporter:
+            yield
+        print(reporter.summary(fields["num_workers"]), flush=True)
+    finally:
+        counter.close()
@@ -0,0 +1,151 @@
+import os
+import io
+import csv
+import sys
+import uuid
+import fcntl
+import socket
+import resource
+import subprocess
+from datetime import datetime, timezone
+
+import dotenv
+import psycopg
+
+from utils import get_psycopg3_connection
+
+dotenv.load_dotenv()
+
+# Bump when the common columns change. Files written with another schema are
+# refused rather than silently getting rows that do not match their header.
+SCHEMA_VERSION = 1
+
+PG_SETTINGS = [
+    "server_version",
+    "shared_buffers",
+    "work_mem",
+    "maintenance_work_mem",
+    "max_wal_size",
+    "checkpoint_timeout",
+    "synchronous_commit",
+    "wal_level",
+    "full_page_writes"
+]
+
+# Worker processes inherit the environment, so every row written by one
+# invocation and its joblib, multiprocessing or subprocess children shares the
+# run id. run_benchmarks.py sets it per cell.
+os.environ.setdefault("BENCHMARK_RUN_ID", uuid.uuid4().hex[:12])
+
+# Per-process caches, filled on the first row a process records.
+_git_rev = None
+_pg_settings = None
+
+def run_id():
+    return os.environ["BENCHMARK_RUN_ID"]
+
+def git_rev():
+    global _git_rev
+    if _git_rev is None:
+        try:
+            _git_rev = subprocess.run(
+                ["git", "describe", "--always", "--dirty"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True,
+                text=True,
+                check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            _git_rev = ""
+    return _git_rev
+
+def pg_settings():
+    # Blank when there is no server to ask, e.g. for write_csv.py.
+    global _pg_settings
+    if _pg_settings is None:
+        try:
+            with get_psycopg3_connection() as conn:
+                rows = conn.execute(
+                    "select name, current_setting(name) from pg_settings where name = any(%s);",
+                    [PG_SETTINGS]
+                ).fetchall()
+            _pg_settings = dict(rows)
+        except psycopg.OperationalError:
+            _pg_settings = {}
+    return _pg_settings
+
+def peak_rss_kib():
+    # ru_maxrss is in KiB on Linux and bytes on macOS. Children only count once
+    # they have been waited for, so this covers finished worker processes.
+    scale = 1024 if sys.platform == "darwin" else 1
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    ) // scale
+
+def common_fields():
+    settings = pg_settings()
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "run_id": run_id(),
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "git_rev": git_rev(),
+        "hostname": socket.gethostname(),
+        "cpu_count": os.cpu_count(),
+        "pid": os.getpid(),
+        "peak_rss_kib": peak_rss_kib(),
+        **{f"pg_{name}": settings.get(name, "") for name in PG_SETTINGS}
+    }
+
+def to_csv_line(values):
+    line = io.StringIO()
+    csv.writer(line, lineterminator="\n").writerow(values)
+    return line.getvalue()
+
+def common_columns():
+    return list(common_fields())
+
+def check_existing_header(filepath, existing_header, header):
+    if existing_header and existing_header != header:
+        raise ValueError(
+            f"{filepath} has the columns {existing_header.strip()} but this benchmark records "
+            f"{header.strip()}. Record into a new file."
+        )
+    return
+
+def check_headers(outputs):
+    # Check (filepath, columns) pairs before a long load rather than when its
+    # results are written at the end. Files not given or not created yet pass.
+    for filepath, columns in outputs:
+        if filepath and os.path.exists(filepath):
+            with open(filepath) as file:
+                check_existing_header(filepath, file.readline(), to_csv_line(columns))
+    return
+
+def append_rows(filepath, rows):
+    # Append rows that all have the same keys. The file is locked while the
+    # header is checked and the rows are written, so any number of processes
+    # can append to the same file.
+    header = to_csv_line(rows[0].keys())
+
+    with open(filepath, "a+") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            file.seek(0)
+            existing_header = file.readline()
+
+            check_existing_header(filepath, existing_header, header)
+            if not existing_header:
+                file.write(header)
+
+            file.write("".join(to_csv_line(row.values()) for row in rows))
+            file.flush()
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+    return
+
+def record(filepath, fields):
+    # Append one row of benchmark-specific fields followed by the common columns.
+    append_rows(filepath, [{**fields, **common_fields()}])
+    return
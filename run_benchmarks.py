@@ -0,0 +1,283 @@
+import os
+import sys
+import csv
+import json
+import uuid
+import time
+import queue
+import argparse
+import itertools
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import dotenv
+import psycopg
+from psycopg import sql
+
+from timer import Timer
+
+dotenv.load_dotenv()
+
+POSTGRES_DB_NAME = os.getenv("POSTGRES_DB_NAME")
+CSV_PATH = os.getenv("CSV_PATH")
+
+# Scripts that write weather_hour{n} files into CSV_PATH while loading, e.g.
+# copy_data.py --method copy_csv, which concurrent cells must not share.
+HOUR_FILE_WRITERS = ["copy_data.py"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run a benchmark matrix described by a JSON spec, e.g. matrices/copy.json."
+    )
+
+    parser.add_argument(
+        "specs",
+        nargs="+",
+        help="Filepaths of matrix specs to run one after another."
+    )
+
+    parser.add_argument(
+        "--server",
+        choices=["fresh", "warm", "external"],
+        default="fresh",
+        help=(
+            "fresh: docker-compose up and down around every cell. warm: start the container once "
+            "and reuse it for every cell. external: use whatever server POSTGRES_HOST and "
+            "POSTGRES_PORT point at, e.g. a locally started one."
+        )
+    )
+
+    parser.add_argument(
+        "--slots",
+        type=int,
+        default=1,
+        help=(
+            "Run up to this many cells at once, each in its own database named "
+            "POSTGRES_DB_NAME_slot<i>. copy_data.py cells also write their hour files to "
+            "CSV_PATH/slot<i>. Needs a warm or external server. Concurrent cells compete "
+            "for the same machine, so keep 1 for timings that will be compared."
+        )
+    )
+
+    parser.add_argument(
+        "--no-skip",
+        action="store_true",
+        default=False,
+        help="Run every cell even if its results are already in the results file."
+    )
+
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="Only print the commands of the cells that would run."
+    )
+
+    args = parser.parse_args()
+
+    if args.slots > 1 and args.server == "fresh":
+        parser.error("--slots needs --server warm or --server external, cells cannot share a restarting server.")
+
+    return args
+
+def load_spec(filepath):
+    with open(filepath) as file:
+        spec = json.load(file)
+
+    spec.setdefault("runs", 1)
+    spec.setdefault("matrix", {})
+    spec.setdefault("args", {})
+    spec.setdefault("create_table_args", {})
+    spec.setdefault("rows_per_cell", 1)
+    spec.setdefault("plots", [])
+
+    return spec
+
+def to_cli(args):
+    # {"table_type": "hyper", "drop_table": true} -> ["--table-type", "hyper", "--drop-table"]
+    cli = []
+    for name, value in args.items():
+        flag = "--" + name.replace("_", "-")
+        if value is True:
+            cli.append(flag)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, list):
+            cli += [flag] + [str(v) for v in value]
+        else:
+            cli += [flag, str(value)]
+    return cli
+
+def matrix_cells(matrix):
+    names = list(matrix)
+    return [dict(zip(names, values)) for values in itertools.product(*matrix.values())]
+
+def completed_runs(spec, cell_args):
+    # Count the rows of the results file that this cell would have written. A
+    # column only has to match when the cell sets an argument of the same name.
+    results_file = spec.get("results_file")
+    if not results_file or not Path(results_file).exists():
+        return 0
+
+    with open(results_file, newline="") as file:
+        rows = sum(
+            all(str(row[name]) == str(value) for name, value in cell_args.items() if name in row)
+            for row in csv.DictReader(file)
+        )
+
+    return rows // spec["rows_per_cell"]
+
+def slot_database(slot):
+    return POSTGRES_DB_NAME if slot is None else f"{POSTGRES_DB_NAME}_slot{slot}"
+
+def slot_csv_path(spec, slot):
+    # A subdirectory keeps the files where the server can read them.
+    if slot is None or not CSV_PATH or spec["script"] not in HOUR_FILE_WRITERS:
+        return CSV_PATH
+    csv_path = os.path.join(CSV_PATH, f"slot{slot}")
+    os.makedirs(csv_path, exist_ok=True)
+    return csv_path
+
+def connect(dbname):
+    return psycopg.connect(
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT"),
+        dbname=dbname,
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        autocommit=True
+    )
+
+def wait_for_server(timeout=300):
+    start = time.perf_counter()
+    while True:
+        try:
+            with connect(POSTGRES_DB_NAME) as conn:
+                conn.execute("select 1;")
+            return
+        except psycopg.OperationalError:
+            if time.perf_counter() - start > timeout:
+                raise
+            time.sleep(2)
+
+def ensure_slot_database(slot):
+    dbname = slot_database(slot)
+
+    with connect(POSTGRES_DB_NAME) as conn:
+        exists = conn.execute("select 1 from pg_database where datname = %s;", [dbname]).fetchone()
+        if not exists:
+            conn.execute(sql.SQL("create database {};").format(sql.Identifier(dbname)))
+
+    with connect(dbname) as conn:
+        conn.execute("create extension if not exists timescaledb;")
+
+    return
+
+def run_command(cmd, env):
+    print(f"+ {' '.join(cmd)}", flush=True)
+    subprocess.run(cmd, env=env, check=True)
+    return
+
+def run_cell(spec, cell_args, slot, server):
+    # create_table.py and the loader share one run id in the results.
+    env = {
+        **os.environ,
+        "POSTGRES_DB_NAME": slot_database(slot),
+        "BENCHMARK_RUN_ID": uuid.uuid4().hex[:12]
+    }
+    csv_path = slot_csv_path(spec, slot)
+    if csv_path:
+        env["CSV_PATH"] = csv_path
+
+    if server == "fresh":
+        run_command(["docker-compose", "up", "--detach"], env)
+        wait_for_server()
+
+    try:
+        create_table_args = {
+            "drop_table": True,
+            "table_type": cell_args["table_type"],
+            **spec["create_table_args"]
+        }
+        run_command([sys.executable, "create_table.py"] + to_cli(create_table_args), env)
+        run_command([sys.executable, spec["script"]] + to_cli(cell_args), env)
+    finally:
+        if server == "fresh":
+            run_command(["docker-compose", "down"], env)
+
+    return
+
+def pending_cells(spec, skip):
+    # Cells in nested-loop order over the matrix, every cell's first run before
+    # any cell's second run.
+    cells = [
+        {**cell, **{name: value for name, value in spec["args"].items() if name not in cell}}
+        for cell in matrix_cells(spec["matrix"])
+    ]
+    done = [completed_runs(spec, cell) if skip else 0 for cell in cells]
+
+    return [
+        cell
+        for run in range(spec["runs"])
+        for cell, cell_done in zip(cells, done)
+        if run >= cell_done
+    ]
+
+def run_spec(filepath, args):
+    spec = load_spec(filepath)
+    cells = pending_cells(spec, skip=not args.no_skip)
+    total = spec["runs"] * len(matrix_cells(spec["matrix"]))
+
+    print(f"{filepath}: {len(cells)} of {total} cells to run, {total - len(cells)} already in the results.")
+
+    if args.dry_run:
+        for cell in cells:
+            print(" ".join([spec["script"]] + to_cli(cell)))
+        return
+
+    with Timer(f"Running {len(cells)} cells of {filepath}"):
+        if args.slots == 1:
+            for cell in cells:
+                run_cell(spec, cell, None, args.server)
+        else:
+            slots = queue.Queue()
+            for slot in range(args.slots):
+                ensure_slot_database(slot)
+                slots.put(slot)
+
+            def run_in_slot(cell):
+                slot = slots.get()
+                try:
+                    run_cell(spec, cell, slot, args.server)
+                finally:
+                    slots.put(slot)
+                return
+
+            with ThreadPoolExecutor(max_workers=args.slots) as pool:
+                for future in [pool.submit(run_in_slot, cell) for cell in cells]:
+                    future.result()
+
+    for plot in spec["plots"]:
+        run_command([sys.executable] + plot, os.environ)
+
+    return
+
+def main(args):
+    if args.server == "warm" and not args.dry_run:
+        run_command(["docker-compose", "up", "--detach"], os.environ)
+
+    try:
+        if args.server != "fresh" and not args.dry_run:
+            wait_for_server()
+
+        for filepath in args.specs:
+            run_spec(filepath, args)
+    finally:
+        if args.server == "warm" and not args.dry_run:
+            run_command(["docker-compose", "down"], os.environ)
+
+    return
+
+if __name__ == "__main__":
+    main(parse_args())
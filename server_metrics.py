@@ -0,0 +1,146 @@
+import time
+import threading
+import contextlib
+from decimal import Decimal
+from datetime import datetime, timezone
+
+import psycopg
+
+from recorder import append_rows, run_id
+from utils import get_psycopg3_connection
+
+# Every query returns (metric, value) rows. Cumulative counters are sampled as
+# they are, so rates come from differencing consecutive samples.
+METRIC_QUERIES = {
+    "wal": "select * from pg_stat_wal;",
+    # PostgreSQL 17 moved the checkpoint counters out of pg_stat_bgwriter.
+    "checkpointer": "select * from pg_stat_checkpointer;",
+    "bgwriter": "select * from pg_stat_bgwriter;",
+    "wait_events": """--sql
+        select coalesce(wait_event_type || ':' || wait_event, 'CPU'), count(*)
+        from pg_stat_activity
+        where state = 'active' and backend_type = 'client backend' and pid <> pg_backend_pid()
+        group by 1;
+    """,
+    "locks": """--sql
+        select mode || case when granted then ':granted' else ':waiting' end, count(*)
+        from pg_locks
+        where locktype = 'relation'
+            and database = (select oid from pg_database where datname = current_database())
+            and pid <> pg_backend_pid()
+        group by 1;
+    """,
+    "copy_progress": """--sql
+        select 'copies', count(*) from pg_stat_progress_copy
+        union all select 'tuples_processed', coalesce(sum(tuples_processed), 0) from pg_stat_progress_copy
+        union all select 'bytes_processed', coalesce(sum(bytes_processed), 0) from pg_stat_progress_copy;
+    """,
+    "timescaledb": """--sql
+        select 'chunks', count(*) from timescaledb_information.chunks where hypertable_name = 'weather';
+    """,
+    "database": "select 'bytes', pg_database_size(current_database());"
+}
+
+METRICS_COLUMNS = [
+    "run_id",
+    "seconds",
+    "sampled_at",
+    "source",
+    "metric",
+    "value"
+]
+
+def numeric_columns(cur):
+    # Wide single-row views such as pg_stat_wal become one metric per numeric column.
+    row = cur.fetchone()
+    if row is None:
+        return []
+    return [
+        (column.name, value)
+        for column, value in zip(cur.description, row)
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+    ]
+
+def sample(conn, sources):
+    metrics = []
+
+    for source in list(sources):
+        try:
+            with conn.cursor() as cur:
+                cur.execute(METRIC_QUERIES[source])
+                if source in ["wal", "checkpointer", "bgwriter"]:
+                    rows = numeric_columns(cur)
+                else:
+                    rows = cur.fetchall()
+        except (psycopg.errors.UndefinedTable, psycopg.errors.UndefinedColumn, psycopg.errors.InvalidSchemaName):
+            # Not available on this server version or without TimescaleDB.
+            sources.remove(source)
+            continue
+
+        metrics += [(source, metric, value) for metric, value in rows]
+
+    return metrics
+
+class MetricsSampler:
+    # Polls server statistics every `period` seconds on its own connection and
+    # appends them in long format, one row per metric, tagged with the run id.
+    def __init__(self, filepath, period):
+        self.filepath = filepath
+        self.period = period
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.errors = []
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+
+        if self.errors:
+            print(f"Server metrics sampling stopped early: {self.errors[0]}")
+
+    def write(self, metrics):
+        elapsed = time.perf_counter() - self.start
+        sampled_at = datetime.now(timezone.utc).isoformat()
+
+        if metrics:
+            append_rows(self.filepath, [
+                {
+                    "run_id": run_id(),
+                    "seconds": elapsed,
+                    "sampled_at": sampled_at,
+                    "source": source,
+                    "metric": metric,
+                    "value": value
+                }
+                for source, metric, value in metrics
+            ])
+
+        return
+
+    def run(self):
+        sources = list(METRIC_QUERIES)
+
+        try:
+            with get_psycopg3_connection() as conn:
+                conn.autocommit = True
+
+                # Sample once straight away and once more after the load stops.
+                self.write(sample(conn, sources))
+                while not self.stopped.wait(self.period):
+                    self.write(sample(conn, sources))
+                self.write(sample(conn, sources))
+        except Exception as e:
+            # Losing the metrics must never fail the load they describe.
+            self.errors.append(e)
+
+        return
+
+def sample_server_metrics(filepath, period):
+    if not filepath:
+        return contextlib.nullcontext()
+    return MetricsSampler(filepath, period)
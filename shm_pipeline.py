@@ -0,0 +1,195 @@
+import time
+import queue
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+
+from write_csv import weather_dataframe
+from copy_encoders import DEFAULT_CHUNK_BYTES, copy_statement, binary_copy_size, write_binary_copy
+from timer import Timer
+from ledger import record_hour
+from utils import get_pooled_psycopg3_connection, num_rows
+
+# The ring buffer and queues are handed to the workers as arguments. The loaders
+# run background threads, e.g. the progress reporter and the metrics sampler,
+# which a plain fork could copy in the middle of holding a lock.
+mp = multiprocessing.get_context("forkserver")
+
+def decode_worker(ring, slot_bytes, hours, free_slots, filled_slots, stats):
+    busy_seconds = 0
+    blocked_seconds = 0
+    start = time.perf_counter()
+
+    try:
+        while (n := hours.get()) is not None:
+            t = time.perf_counter()
+            df = weather_dataframe(n)
+            busy_seconds += time.perf_counter() - t
+
+            # Waiting for a free slot means the COPY side is the bottleneck.
+            t = time.perf_counter()
+            slot = free_slots.get()
+            blocked_seconds += time.perf_counter() - t
+
+            t = time.perf_counter()
+            with ring.buf[slot * slot_bytes:(slot + 1) * slot_bytes] as slot_buffer, Timer(name="encode", quiet=True):
+                nbytes = write_binary_copy(df, slot_buffer)
+            busy_seconds += time.perf_counter() - t
+
+            filled_slots.put((slot, n, df.shape[0], nbytes))
+    finally:
+        # Always report so the parent never waits on a worker that crashed.
+        stats.put(("decode", busy_seconds, blocked_seconds, time.perf_counter() - start))
+
+    return
+
+def copy_worker(ring, slot_bytes, filled_slots, free_slots, stats, args, log_benchmark):
+    busy_seconds = 0
+    blocked_seconds = 0
+    start = time.perf_counter()
+
+    conn, connect_seconds = get_pooled_psycopg3_connection(warm_up=args.warm_up)
+
+    # Hours copied since the last commit, committed every --hours-per-transaction.
+    uncommitted = 0
+
+    try:
+        while True:
+            # Waiting for a filled slot means the decode side is the bottleneck.
+            t = time.perf_counter()
+            item = filled_slots.get()
+            blocked_seconds += time.perf_counter() - t
+
+            if item is None:
+                break
+
+            slot, n, hour_rows, nbytes = item
+
+            full_timer = Timer(
+                f"COPYing hour {n} from shared memory slot {slot} (counting overhead)",
+                n=hour_rows,
+                units="inserts",
+                name="hour"
+            )
+
+            copy_timer = Timer(
+                f"COPYing hour {n} from shared memory slot {slot}",
+                n=hour_rows,
+                units="inserts",
+                name="copy"
+            )
+
+            offset = slot * slot_bytes
+            with ring.buf[offset:offset + nbytes] as data, conn.cursor() as cur, full_timer:
+                with cur.copy(copy_statement("binary")) as copy, copy_timer:
+                    for chunk_start in range(0, nbytes, DEFAULT_CHUNK_BYTES):
+                        with Timer(name="write", quiet=True):
+                            copy.write(data[chunk_start:chunk_start + DEFAULT_CHUNK_BYTES])
+
+                record_hour(cur, n, hour_rows)
+
+                uncommitted += 1
+                if uncommitted == args.hours_per_transaction:
+                    with Timer(name="commit", quiet=True):
+                        conn.commit()
+                    uncommitted = 0
+
+            free_slots.put(slot)
+            busy_seconds += full_timer.interval
+
+            log_benchmark(args, n, hour_rows, full_timer, copy_timer, connect_seconds)
+            connect_seconds = 0.0
+
+        if uncommitted:
+            conn.commit()
+    finally:
+        stats.put(("copy", busy_seconds, blocked_seconds, time.perf_counter() - start))
+
+    return
+
+def collect_stats(stats, collected, stage, count, processes):
+    # A worker that dies, e.g. a COPY worker on a load_ledger conflict, never
+    # hands back its slot and the others would wait for it forever, so stop
+    # waiting as soon as any worker has failed.
+    while sum(s[0] == stage for s in collected) < count:
+        try:
+            collected.append(stats.get(timeout=1))
+        except queue.Empty:
+            pass
+
+        failed = [p for p in processes if p.exitcode not in [None, 0]]
+        if failed:
+            raise RuntimeError(f"{len(failed)} pipeline workers failed, see their tracebacks above.")
+
+    return collected
+
+def print_utilization(stats, workers):
+    for stage, waiting_for in [("decode", "free slots"), ("copy", "filled slots")]:
+        stage_stats = [s for s in stats if s[0] == stage]
+        wall = sum(s[3] for s in stage_stats)
+        busy = sum(s[1] for s in stage_stats) / wall
+        blocked = sum(s[2] for s in stage_stats) / wall
+        print(
+            f"{stage} stage: {workers[stage]} workers, {100 * busy:.1f}% busy, "
+            f"{100 * blocked:.1f}% waiting for {waiting_for}."
+        )
+    return
+
+def run_shm_pipeline(hours, args, log_benchmark):
+    # Each slot holds one hour encoded as a complete binary COPY stream. Decoders
+    # encode straight into a free slot and COPY workers stream it out without
+    # the hour ever being pickled or copied between processes.
+    slot_bytes = binary_copy_size(num_rows(1))
+    num_slots = args.decode_workers + args.copy_workers
+    ring = SharedMemory(create=True, size=num_slots * slot_bytes)
+
+    hour_queue = mp.Queue()
+    free_slots = mp.Queue()
+    filled_slots = mp.Queue()
+    stats = mp.Queue()
+
+    for n in hours:
+        hour_queue.put(n)
+    for _ in range(args.decode_workers):
+        hour_queue.put(None)
+    for slot in range(num_slots):
+        free_slots.put(slot)
+
+    decoders = [
+        mp.Process(target=decode_worker, args=(ring, slot_bytes, hour_queue, free_slots, filled_slots, stats))
+        for _ in range(args.decode_workers)
+    ]
+
+    copiers = [
+        mp.Process(target=copy_worker, args=(ring, slot_bytes, filled_slots, free_slots, stats, args, log_benchmark))
+        for _ in range(args.copy_workers)
+    ]
+
+    try:
+        for process in decoders + copiers:
+            process.start()
+
+        stage_stats = collect_stats(stats, [], "decode", args.decode_workers, decoders + copiers)
+
+        for process in decoders:
+            process.join()
+        for _ in range(args.copy_workers):
+            filled_slots.put(None)
+
+        collect_stats(stats, stage_stats, "copy", args.copy_workers, decoders + copiers)
+
+        for process in copiers:
+            process.join()
+
+        failed = [p for p in decoders + copiers if p.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"{len(failed)} pipeline workers failed, see their tracebacks above.")
+    finally:
+        for process in decoders + copiers:
+            if process.is_alive():
+                process.terminate()
+        ring.close()
+        ring.unlink()
+
+    print_utilization(stage_stats, {"decode": args.decode_workers, "copy": args.copy_workers})
+
+    return
@@ -1,27 +1,239 @@
+import os
+import json
+import math
 import time
+import contextvars
+
+# Timers entered inside another timer become its children, in the same thread
+# or asyncio task. Each task and thread starts its own tree.
+_active_spans = contextvars.ContextVar("active_spans", default=())
+
+# Log-bucketed latency histograms of every named span finished in this process,
+# see process_span_histograms.
+_span_histograms = {}
+_span_histograms_pid = os.getpid()
+
+def quiet():
+    # Set in the environment so worker processes inherit it.
+    return os.environ.get("TIMER_QUIET") == "1"
+
+def set_quiet(value=True):
+    os.environ["TIMER_QUIET"] = "1" if value else "0"
+    return
+
+class LogHistogram:
+    # HDR-style: SUB_BUCKETS buckets per power of two, so every recorded value
+    # is known to within about 4.4% whatever its magnitude.
+    SUB_BUCKETS = 16
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def bucket(self, seconds):
+        return math.floor(math.log2(max(seconds, 1e-9)) * self.SUB_BUCKETS)
+
+    def bucket_upper_bound(self, bucket):
+        return 2 ** ((bucket + 1) / self.SUB_BUCKETS)
+
+    def add(self, seconds):
+        bucket = self.bucket(seconds)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        return
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, q):
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= q / 100 * self.count:
+                return min(self.bucket_upper_bound(bucket), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "buckets": {str(bucket): count for bucket, count in self.buckets.items()},
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.buckets = {int(bucket): count for bucket, count in data["buckets"].items()}
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+def process_span_histograms():
+    # Forked workers start with a copy of their parent's histograms, which
+    # the parent already counts, so start afresh in every new process.
+    global _span_histograms, _span_histograms_pid
+    if _span_histograms_pid != os.getpid():
+        _span_histograms = {}
+        _span_histograms_pid = os.getpid()
+    return _span_histograms
+
+def save_span_histograms():
+    # With TIMER_SPANS_PATH set, every process keeps its histograms in its own
+    # file there so the parent can merge them, see merged_span_histograms.
+    path = os.environ.get("TIMER_SPANS_PATH")
+    if not path:
+        return
+
+    filepath = os.path.join(path, f"spans_{os.getpid()}.json")
+    tmp_filepath = f"{filepath}.tmp"
+    with open(tmp_filepath, "w") as file:
+        json.dump({name: histogram.to_dict() for name, histogram in process_span_histograms().items()}, file)
+    os.replace(tmp_filepath, filepath)
+
+    return
+
+def merged_span_histograms(path=None):
+    path = path or os.environ.get("TIMER_SPANS_PATH")
+    merged = {}
+
+    # This process's own file may be missing its latest spans, so use the
+    # histograms in memory instead.
+    histograms = [process_span_histograms()]
+
+    own_filename = f"spans_{os.getpid()}.json"
+    for filename in sorted(os.listdir(path)) if path else []:
+        if filename.endswith(".json") and filename != own_filename:
+            with open(os.path.join(path, filename)) as file:
+                histograms.append({name: LogHistogram.from_dict(data) for name, data in json.load(file).items()})
+
+    for process_histograms in histograms:
+        for name, histogram in process_histograms.items():
+            merged.setdefault(name, LogHistogram()).merge(histogram)
+
+    return merged
+
+def print_span_summary(histograms):
+    for name, histogram in sorted(histograms.items(), key=lambda item: -item[1].total):
+        print(
+            f"Span {name}: n={histogram.count}, total {histogram.total:.4f} s, "
+            f"p50 {histogram.percentile(50):.4f} s, p90 {histogram.percentile(90):.4f} s, "
+            f"p99 {histogram.percentile(99):.4f} s, max {histogram.max:.4f} s."
+        )
+    return
 
 class Timer:
     def __init__(
         self,
         message="Timer",
         n=None,
-        units="operations"
+        units="operations",
+        name=None,
+        quiet=None
     ):
+        # Only spans with a name, e.g. "decode" or "commit", are kept in the
+        # histograms and shown in their parent's breakdown under that name.
+        # quiet=None follows TIMER_QUIET, True or False overrides it.
         self.message = message
         self.n = n
         self.units = units
+        self.name = name
+        self.quiet = quiet
+        self.children = []
 
     def __enter__(self):
-        print(f"{self.message}: started.")
+        # Forked workers inherit the timers their parent had open, which finish
+        # in the parent, so a worker's first timer starts its own tree.
+        self.pid = os.getpid()
+        spans = _active_spans.get()
+        if spans and spans[-1].pid != self.pid:
+            spans = ()
+        self.parent = spans[-1] if spans else None
+        self.token = _active_spans.set(spans + (self,))
+
+        if not self.silent():
+            print(f"{self.message}: started.")
         self.start = time.perf_counter()
         return self
 
     def __exit__(self, *args):
         self.end = time.perf_counter()
         self.interval = self.end - self.start
+        _active_spans.reset(self.token)
+
+        if self.parent is not None:
+            self.parent.children.append(self)
+
+        if self.name:
+            process_span_histograms().setdefault(self.name, LogHistogram()).add(self.interval)
+            if self.parent is None:
+                save_span_histograms()
 
         if self.n and self.units:
             self.rate = self.n / self.interval
-            print(f"{self.message}: {self.interval:.4f} seconds (n={self.n}, {self.rate:.2f} {self.units} per second).")
-        else:
+            if not self.silent():
+                print(f"{self.message}: {self.interval:.4f} seconds (n={self.n}, {self.rate:.2f} {self.units} per second).")
+        elif not self.silent():
             print(f"{self.message}: {self.interval:.4f} seconds.")
+
+        if self.children and not self.silent():
+            print(f"{self.message}: {self.format_breakdown()}.")
+
+    def silent(self):
+        return quiet() if self.quiet is None else self.quiet
+
+    def breakdown(self):
+        # Seconds per child span, summed over repeated children, plus the time
+        # not covered by any child.
+        stages = {}
+        for child in self.children:
+            stage = child.name or child.message
+            stages[stage] = stages.get(stage, 0.0) + child.interval
+        stages["other"] = self.interval - sum(child.interval for child in self.children)
+        return stages
+
+    def format_breakdown(self):
+        return ", ".join(
+            f"{stage} {seconds:.4f} ({100 * seconds / self.interval:.1f}%)"
+            for stage, seconds in self.breakdown().items()
+        )
+
+def detach_spans():
+    # Start a new tree in the current asyncio task. Tasks inherit the timer that
+    # was open when they were created, whose breakdown would then count the
+    # overlapping spans of concurrent tasks as if they ran one after another.
+    _active_spans.set(())
+    return
+
+def spans(iterable, name):
+    # Yield from iterable, timing how long every item takes to produce as a
+    # silent child span of the current timer.
+    iterator = iter(iterable)
+    done = object()
+
+    try:
+        while True:
+            with Timer(name=name, quiet=True):
+                item = next(iterator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        # Stopping early, e.g. when the consumer raises, also stops the iterable.
+        if hasattr(iterator, "close"):
+            iterator.close()
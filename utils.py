@@ -1,4 +1,6 @@
 import os
+import time
+import atexit
 import subprocess
 
 import dotenv
@@ -17,6 +19,11 @@ CONTAINER_NAME = os.getenv("CONTAINER_NAME")
 def num_rows(hours):
     return hours * 1038240
 
+def transaction_ranges(total_rows, rows_per_transaction=None):
+    # (start, stop) row ranges to commit one at a time. None means a single transaction.
+    step = rows_per_transaction or max(total_rows, 1)
+    return [(start, min(start + step, total_rows)) for start in range(0, total_rows, step)]
+
 def sqlalchemy_connection_string():
     return f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB_NAME}"
 
@@ -24,15 +31,59 @@ def get_sqlalchemy_engine():
     engine = sqlalchemy.create_engine(sqlalchemy_connection_string())
     return engine
 
-def get_psycopg3_connection():
-    connection_string = (
+def psycopg3_connection_string():
+    return (
         f"host={POSTGRES_HOST} "
         f"port={POSTGRES_PORT} "
         f"dbname={POSTGRES_DB_NAME} "
         f"user={POSTGRES_USER} "
         f"password={POSTGRES_PASSWORD}"
     )
-    return psycopg.connect(connection_string)
+
+def get_psycopg3_connection():
+    return psycopg.connect(psycopg3_connection_string())
+
+async def get_async_psycopg3_connection():
+    return await psycopg.AsyncConnection.connect(psycopg3_connection_string())
+
+# One long-lived connection per process. joblib's loky workers are reused across
+# tasks, so each worker pays the TCP and authentication handshake only once.
+_pooled_connection = None
+
+def warm_up_connection(conn):
+    # Load the weather table's catalog entries into the backend's caches.
+    with conn.cursor() as cur:
+        cur.execute("select * from weather limit 0;")
+    conn.commit()
+    return
+
+def get_pooled_psycopg3_connection(warm_up=False, keep_transaction=False):
+    # Returns the connection and the seconds spent connecting (0 when reused).
+    # Unless keep_transaction is set, a transaction left open by an earlier task
+    # is rolled back.
+    global _pooled_connection
+
+    if _pooled_connection is not None and not _pooled_connection.closed:
+        if not keep_transaction and _pooled_connection.info.transaction_status != psycopg.pq.TransactionStatus.IDLE:
+            _pooled_connection.rollback()
+        return _pooled_connection, 0.0
+
+    start = time.perf_counter()
+
+    _pooled_connection = get_psycopg3_connection()
+    if warm_up:
+        warm_up_connection(_pooled_connection)
+
+    return _pooled_connection, time.perf_counter() - start
+
+def close_pooled_psycopg3_connection():
+    global _pooled_connection
+    if _pooled_connection is not None:
+        _pooled_connection.close()
+        _pooled_connection = None
+    return
+
+atexit.register(close_pooled_psycopg3_connection)
 
 def run_in_container(cmd):
     # Use Popen so we can watch output in real-time
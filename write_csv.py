@@ -1,15 +1,27 @@
 import os
+import json
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 import dotenv
+import numpy as np
+import pandas as pd
 import xarray as xr
 from tqdm import tqdm
 from joblib import Parallel, delayed
 
 from timer import Timer
+from recorder import record
+from copy_encoders import FLOAT_COLUMNS, text_block, binary_copy_chunks
 
 dotenv.load_dotenv()
 
 CSV_PATH = os.getenv("CSV_PATH")
+GRID_CACHE_PATH = os.getenv("GRID_CACHE_PATH", ".grid_cache")
+HOUR_CACHE_PATH = os.getenv("HOUR_CACHE_PATH")
+HOUR_CACHE_BYTES = int(float(os.getenv("HOUR_CACHE_GB") or 20) * 1024**3)
 
 nc_filepaths = [
     "e5.oper.an.sfc.128_164_tcc.ll025sc.1995030100_1995033123.nc",
@@ -36,59 +48,534 @@ def latlon_to_location_id(lats, lons, dlat=0.25, dlon=0.25, min_lat=-90, min_lon
     lon_indices = ((lons - min_lon) / dlon).astype(int)
     return lat_indices * n_lons + lon_indices + 1
 
+# Datasets opened by this process, keyed on the file list and their mtimes. joblib's
+# loky workers are reused across tasks so every worker only opens the files once.
+_dataset_cache = {}
+dataset_cache_stats = {"hits": 0, "misses": 0}
+
+def dataset_cache_key(filepaths):
+    return tuple((filepath, os.stat(filepath).st_mtime_ns) for filepath in filepaths)
+
+def open_weather_dataset(filepaths=nc_filepaths):
+    key = dataset_cache_key(filepaths)
+
+    if key in _dataset_cache:
+        dataset_cache_stats["hits"] += 1
+        return _dataset_cache[key]
+
+    dataset_cache_stats["misses"] += 1
+
+    # Files changed on disk so drop any stale handles for the same file list.
+    for stale_key in [k for k in _dataset_cache if [f for f, _ in k] == list(filepaths)]:
+        _dataset_cache.pop(stale_key).close()
+
+    _dataset_cache[key] = xr.open_mfdataset(filepaths)
+    return _dataset_cache[key]
+
+def dataset_cache_summary():
+    return f"dataset cache: {dataset_cache_stats['hits']} hits, {dataset_cache_stats['misses']} misses"
+
+def compute_static_grid(lats, lons_east):
+    # Convert longitude from [0, 360) degrees East to [-180, 180) degrees East.
+    lons = np.where(lons_east > 180, lons_east - 360, lons_east)
+
+    # Rows are ordered latitude-major to match ds[var].transpose("latitude", "longitude").
+    latitude = np.repeat(lats, len(lons))
+    longitude = np.tile(lons, len(lats))
+
+    return {
+        "latitude": latitude.astype(np.float32),
+        "longitude": longitude.astype(np.float32),
+        "location_id": latlon_to_location_id(latitude, longitude).astype(np.int32)
+    }
+
+def grid_cache_key(lats, lons_east):
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(lats, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(lons_east, dtype=np.float64).tobytes())
+    return digest.hexdigest()[:16]
+
+# Static columns memory-mapped by this process, keyed on the grid definition.
+_grid_cache = {}
+
+def static_grid(ds):
+    lats = ds.latitude.values
+    lons_east = ds.longitude.values
+    key = grid_cache_key(lats, lons_east)
+
+    if key in _grid_cache:
+        return _grid_cache[key]
+
+    filepaths = {
+        name: os.path.join(GRID_CACHE_PATH, f"grid_{key}_{name}.npy")
+        for name in ["latitude", "longitude", "location_id"]
+    }
+
+    if not all(os.path.exists(filepath) for filepath in filepaths.values()):
+        os.makedirs(GRID_CACHE_PATH, exist_ok=True)
+        for name, values in compute_static_grid(lats, lons_east).items():
+            # Write then rename so concurrent workers never map a partial file.
+            tmp_filepath = f"{filepaths[name]}.{os.getpid()}.tmp"
+            with open(tmp_filepath, "wb") as file:
+                np.save(file, values)
+            os.replace(tmp_filepath, filepaths[name])
+
+    # Memory-mapped read-only, so every worker shares the same page cache pages.
+    _grid_cache[key] = {
+        name: np.load(filepath, mmap_mode="r")
+        for name, filepath in filepaths.items()
+    }
+
+    return _grid_cache[key]
+
+def convert_units(variables):
+    variables["temperature_2m"] = variables["temperature_2m"] - 273.15  # Kelvin to Celsius
+    variables["total_precipitation"] = variables["total_precipitation"] * 1000  # m to mm
+    variables["snowfall"] = variables["snowfall"] * 1000  # m to mm
+    return variables
+
+def hour_columns(grid, time, variables):
+    return {
+        "time": np.full(grid["location_id"].shape[0], time),
+        "location_id": grid["location_id"],
+        "latitude": grid["latitude"],
+        "longitude": grid["longitude"],
+        "temperature_2m": variables["temperature_2m"],
+        "zonal_wind_10m": variables["zonal_wind_10m"],
+        "meridional_wind_10m": variables["meridional_wind_10m"],
+        "total_cloud_cover": variables["total_cloud_cover"],
+        "total_precipitation": variables["total_precipitation"],
+        "snowfall": variables["snowfall"]
+    }
+
+def decode_hour(n):
+    ds = open_weather_dataset()
+    grid = static_grid(ds)
+    hour = ds.isel(time=n)
+
+    variables = convert_units({
+        col: hour[var].transpose("latitude", "longitude").values.ravel()
+        for var, col in cols_renamed.items()
+    })
+
+    return hour_columns(grid, hour.time.values, variables)
+
+def decode_block(start, stop):
+    # Read hours [start, stop) of every variable in one contiguous slice, then
+    # split the block into hours.
+    ds = open_weather_dataset()
+    grid = static_grid(ds)
+    block = ds.isel(time=slice(start, stop))
+
+    variables = convert_units({
+        col: block[var].transpose("time", "latitude", "longitude").values.reshape(stop - start, -1)
+        for var, col in cols_renamed.items()
+    })
+
+    for i, time in enumerate(block.time.values):
+        yield start + i, hour_columns(grid, time, {col: values[i] for col, values in variables.items()})
+
+# Decoded hours are cached under HOUR_CACHE_PATH as one directory of .npy files per
+# hour, keyed on the content of the NetCDF files, and evicted least recently used
+# first once the cache grows past HOUR_CACHE_GB. Unset HOUR_CACHE_PATH to disable.
+hour_cache_stats = {"hits": 0, "misses": 0}
+_source_hashes = {}
+
+def file_sha1(filepath, block_bytes=16 * 1024**2):
+    digest = hashlib.sha1()
+    with open(filepath, "rb") as file:
+        while block := file.read(block_bytes):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_hash(filepath):
+    # Hashing gigabytes of NetCDF takes a while, so hashes are remembered on disk
+    # for as long as the file keeps the same size and mtime.
+    stat = os.stat(filepath)
+    memo_key = f"{os.path.abspath(filepath)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    if memo_key not in _source_hashes:
+        memo_filepath = os.path.join(HOUR_CACHE_PATH, "source_hashes.json")
+        memo = {}
+        if os.path.exists(memo_filepath):
+            with open(memo_filepath) as file:
+                memo = json.load(file)
+
+        if memo_key not in memo:
+            memo[memo_key] = file_sha1(filepath)
+            tmp_filepath = f"{memo_filepath}.{os.getpid()}.tmp"
+            with open(tmp_filepath, "w") as file:
+                json.dump(memo, file, indent=2)
+            os.replace(tmp_filepath, memo_filepath)
+
+        _source_hashes[memo_key] = memo[memo_key]
+
+    return _source_hashes[memo_key]
+
+def hour_cache_key(filepaths, n):
+    digest = hashlib.sha1()
+    for filepath in filepaths:
+        digest.update(source_hash(filepath).encode())
+    return f"{digest.hexdigest()[:16]}_hour{n}"
+
+def cached_hour(key):
+    dirpath = os.path.join(HOUR_CACHE_PATH, key)
+
+    if not os.path.isdir(dirpath):
+        return None
+
+    # Another worker may evict the hour at any point until its files are
+    # mapped, which counts as a miss.
+    try:
+        # The directory mtime is the last use for LRU eviction.
+        os.utime(dirpath)
+
+        with open(os.path.join(dirpath, "columns.json")) as file:
+            columns = json.load(file)
+
+        return {
+            col: np.load(os.path.join(dirpath, f"{col}.npy"), mmap_mode="r")
+            for col in columns
+        }
+    except FileNotFoundError:
+        return None
+
+def hour_cache_entries():
+    # Skip entries that another worker evicts while they are being sized.
+    entries = []
+    for entry in os.scandir(HOUR_CACHE_PATH):
+        if entry.is_dir() and not entry.name.endswith(".tmp"):
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.path))
+            except FileNotFoundError:
+                continue
+    return entries
+
+def evict_hours(budget=HOUR_CACHE_BYTES):
+    entries = sorted(hour_cache_entries())
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, dirpath in entries:
+        if total <= budget:
+            break
+        # Workers that already mapped these files keep reading them after the unlink.
+        shutil.rmtree(dirpath, ignore_errors=True)
+        total -= size
+
+    return
+
+def store_hour(key, columns):
+    dirpath = os.path.join(HOUR_CACHE_PATH, key)
+    tmp_dirpath = f"{dirpath}.{os.getpid()}.tmp"
+
+    os.makedirs(tmp_dirpath, exist_ok=True)
+    for col, values in columns.items():
+        np.save(os.path.join(tmp_dirpath, f"{col}.npy"), values)
+    with open(os.path.join(tmp_dirpath, "columns.json"), "w") as file:
+        json.dump(list(columns), file)
+
+    # Rename the complete directory into place so no worker maps a partial hour.
+    try:
+        os.rename(tmp_dirpath, dirpath)
+    except OSError:
+        # Another worker stored the same hour first.
+        shutil.rmtree(tmp_dirpath, ignore_errors=True)
+
+    evict_hours()
+
+    return
+
+def load_hour(n):
+    if not HOUR_CACHE_PATH:
+        return decode_hour(n)
+
+    os.makedirs(HOUR_CACHE_PATH, exist_ok=True)
+    key = hour_cache_key(nc_filepaths, n)
+    columns = cached_hour(key)
+
+    if columns is not None:
+        hour_cache_stats["hits"] += 1
+        return columns
+
+    hour_cache_stats["misses"] += 1
+    columns = decode_hour(n)
+    store_hour(key, columns)
+
+    return columns
+
+def hour_cache_summary():
+    return f"hour cache: {hour_cache_stats['hits']} hits, {hour_cache_stats['misses']} misses"
+
 def weather_dataframe(n):
-    with Timer(f"Loading data for hour {n}"):
-        ds = xr.open_mfdataset(nc_filepaths)
-        df = ds.isel(time=n).to_dataframe().reset_index()
-
-        df.drop(columns=["utc_date"], inplace=True)
-        df.rename(columns=cols_renamed, inplace=True)
-
-        df["temperature_2m"] -= 273.15  # Kelvin to Celsius
-        df["total_precipitation"] *= 1000  # m to mm
-        df["snowfall"] *= 1000  # m to mm
-
-        # Convert latitude from [0, 360) degrees East to [-180, 180) degrees East.
-        df.rename(columns={"longitude": "longitude_east"}, inplace=True)
-        df["longitude"] = df["longitude_east"].apply(lambda x: x - 360 if x > 180 else x)
-        df.drop(columns=["longitude_east"], inplace=True)
-
-        df["location_id"] = latlon_to_location_id(df.latitude, df.longitude)
-
-        df = df[[
-            "time",
-            "location_id",
-            "latitude",
-            "longitude",
-            "temperature_2m",
-            "zonal_wind_10m",
-            "meridional_wind_10m",
-            "total_cloud_cover",
-            "total_precipitation",
-            "snowfall"
-        ]]
-    
+    with Timer(f"Loading data for hour {n}", name="decode") as timer:
+        df = pd.DataFrame(load_hour(n))
+
+        timer.message += f" ({dataset_cache_summary()}"
+        if HOUR_CACHE_PATH:
+            timer.message += f", {hour_cache_summary()}"
+        timer.message += ")"
+
     return df
 
-def write_csv(df, filepath):
-    with Timer(f"Saving {filepath}", n=df.shape[0]):
-        df.to_csv(
-            filepath,
+def write_csv_pandas(df, filepath, float_precision=None):
+    df.to_csv(
+        filepath,
+        index=False,
+        header=False,
+        date_format="%Y-%m-%d %H:%M:%S",
+        float_format=f"%.{float_precision}g" if float_precision else None
+    )
+    return
+
+def write_csv_numpy(df, filepath, float_precision=None, threads=None):
+    # Fixed-width rows formatted by copy_encoders.text_block. NumPy releases the
+    # GIL inside its kernels, so blocks are formatted on several threads and
+    # written out in order.
+    threads = threads or os.cpu_count()
+    significant_digits = float_precision or 9
+    rows_per_block = 65536
+    starts = range(0, df.shape[0], rows_per_block)
+
+    def block(start):
+        stop = min(start + rows_per_block, df.shape[0])
+        return text_block(df, start, stop, delimiter=",", significant_digits=significant_digits)
+
+    with open(filepath, "wb") as file, ThreadPoolExecutor(max_workers=threads) as pool:
+        for data in pool.map(block, starts):
+            file.write(data)
+
+    return
+
+def round_significant(values, digits):
+    magnitude = np.abs(values)
+    exponent = np.floor(np.log10(np.where(magnitude > 0, magnitude, 1)))
+    scale = 10.0 ** (digits - 1 - exponent)
+    return (np.round(values * scale) / scale).astype(values.dtype)
+
+def write_csv_pyarrow(df, filepath, float_precision=None):
+    # pyarrow is not a dependency of the project, so only import it when asked for.
+    try:
+        import pyarrow as pa
+        import pyarrow.csv
+    except ImportError:
+        raise ImportError("The pyarrow CSV backend needs pyarrow installed, e.g. poetry add pyarrow.")
+
+    if float_precision:
+        df = df.assign(**{
+            col: round_significant(df[col].to_numpy(), float_precision)
+            for col in FLOAT_COLUMNS
+        })
+
+    pa.csv.write_csv(
+        pa.Table.from_pandas(df, preserve_index=False),
+        filepath,
+        write_options=pa.csv.WriteOptions(include_header=False)
+    )
+    return
+
+csv_backends = {
+    "pandas": write_csv_pandas,
+    "numpy": write_csv_numpy,
+    "pyarrow": write_csv_pyarrow
+}
+
+def write_csv(df, filepath, backend="pandas", float_precision=None, threads=None):
+    # Only the numpy backend formats on several threads.
+    options = {"threads": threads} if backend == "numpy" else {}
+
+    with Timer(f"Saving {filepath} using {backend}", n=df.shape[0], name="encode") as timer:
+        csv_backends[backend](df, filepath, float_precision=float_precision, **options)
+    return timer
+
+def write_binary(df, filepath):
+    # PostgreSQL binary COPY format, loadable with COPY ... WITH (FORMAT binary)
+    # without the server parsing any text.
+    with Timer(f"Saving {filepath} in binary COPY format", n=df.shape[0], name="encode") as timer:
+        with open(filepath, "wb") as file:
+            for chunk in binary_copy_chunks(df):
+                file.write(chunk)
+    return timer
+
+def csv_chunks(df, chunk_rows=100_000):
+    for start in range(0, df.shape[0], chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows].to_csv(
             index=False,
             header=False,
             date_format="%Y-%m-%d %H:%M:%S"
         )
-    return filepath
+        yield chunk.encode()
 
-def _tmp(n):
-    return write_csv(weather_dataframe(n), f"{CSV_PATH}/weather_hour{n}.csv")
+def write_hour_files(n, df, args):
+    if "csv" in args.formats:
+        write_csv(
+            df,
+            f"{CSV_PATH}/weather_hour{n}.csv",
+            backend=args.backend,
+            float_precision=args.float_precision,
+            # Every joblib worker formats at once, so share the cores between them.
+            threads=max(1, (os.cpu_count() or 1) // args.workers)
+        )
 
-if __name__ == "__main__":
-    ds = xr.open_dataset("e5.oper.an.sfc.128_167_2t.ll025sc.1995030100_1995033123.nc")
+    if "binary" in args.formats:
+        write_binary(df, f"{CSV_PATH}/weather_hour{n}.bin")
+
+    return
+
+def _tmp(n, args):
+    write_hour_files(n, weather_dataframe(n), args)
+    return
+
+def time_chunk_hours(filepaths=nc_filepaths):
+    # Hours per on-disk chunk along time, as the least common multiple over every
+    # variable so that blocks start on a chunk boundary in every file.
+    hours = 1
+    for filepath in filepaths:
+        with xr.open_dataset(filepath) as ds:
+            for var in ds.data_vars:
+                chunksizes = ds[var].encoding.get("chunksizes")
+                if chunksizes and "time" in ds[var].dims:
+                    hours = np.lcm(hours, chunksizes[ds[var].dims.index("time")])
+    return int(hours)
+
+def block_hours(args, min_hours=24):
+    if args.block_hours != "auto":
+        return args.block_hours
+    chunk_hours = time_chunk_hours()
+    return chunk_hours * -(-min_hours // chunk_hours)
+
+def convert_block(start, stop, args):
+    with Timer(f"Converting hours {start} to {stop - 1}", n=stop - start, units="hours"):
+        for n, columns in decode_block(start, stop):
+            if HOUR_CACHE_PATH:
+                os.makedirs(HOUR_CACHE_PATH, exist_ok=True)
+                store_hour(hour_cache_key(nc_filepaths, n), columns)
+            write_hour_files(n, pd.DataFrame(columns), args)
+    return
+
+def block_hours_type(value):
+    if value == "auto":
+        return value
+    return int(value)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Convert ERA5 NetCDF data to one CSV file per hour."
+    )
 
-    Parallel(n_jobs=32)(
-        delayed(_tmp)(n)
-        for n in tqdm(range(len(ds.time)))
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=["csv", "binary"],
+        default=["csv"],
+        help="File formats to write: weather_hour{n}.csv and/or weather_hour{n}.bin in binary COPY format."
     )
 
+    parser.add_argument(
+        "--backend",
+        choices=list(csv_backends),
+        default="pandas",
+        help="How to format the CSV files."
+    )
+
+    parser.add_argument(
+        "--float-precision",
+        type=int,
+        help="Significant digits written for the float4 columns. Defaults to each backend's round-tripping output."
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=32,
+        help="Number of parallel workers."
+    )
+
+    parser.add_argument(
+        "--block-hours",
+        type=block_hours_type,
+        help=(
+            "Convert blocks of this many consecutive hours per worker, reading each variable once "
+            "per block instead of once per hour. 'auto' aligns blocks to the files' time chunking. "
+            "Every worker holds a whole block in memory, roughly 25 MB per hour, so use fewer workers."
+        )
+    )
+
+    parser.add_argument(
+        "--benchmark-backends",
+        action="store_true",
+        default=False,
+        help="Instead of converting every hour, time every backend converting the same hour."
+    )
+
+    parser.add_argument(
+        "--hour",
+        type=int,
+        default=0,
+        help="Hour to convert with --benchmark-backends."
+    )
+
+    parser.add_argument(
+        "--benchmarks-file",
+        type=str,
+        help="Filepath to output backend benchmarks to a CSV file."
+    )
+
+    args = parser.parse_args()
+
+    # The numpy backend needs room for the exponent, so every backend takes the same values.
+    if args.float_precision is not None and args.float_precision < 3:
+        parser.error("--float-precision needs at least 3 significant digits.")
+
+    return args
+
+def log_benchmark(args, backend, timer, filepath):
+    record(args.benchmarks_file, {
+        "backend": backend,
+        "float_precision": args.float_precision or "",
+        "hour": args.hour,
+        "num_rows": timer.n,
+        "seconds": timer.interval,
+        "rate": timer.rate,
+        "units": timer.units,
+        "bytes": os.path.getsize(filepath)
+    })
+    return
+
+def benchmark_backends(args):
+    df = weather_dataframe(args.hour)
+
+    for backend in csv_backends:
+        filepath = f"{CSV_PATH}/weather_hour{args.hour}_{backend}.csv"
+        try:
+            timer = write_csv(df, filepath, backend=backend, float_precision=args.float_precision)
+        except ImportError as e:
+            print(f"Skipping {backend}: {e}")
+            continue
+
+        if args.benchmarks_file:
+            log_benchmark(args, backend, timer, filepath)
+
+    return
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.benchmark_backends:
+        benchmark_backends(args)
+    else:
+        ds = xr.open_dataset("e5.oper.an.sfc.128_167_2t.ll025sc.1995030100_1995033123.nc")
+
+        if args.block_hours:
+            size = block_hours(args)
+            Parallel(n_jobs=args.workers)(
+                delayed(convert_block)(start, min(start + size, len(ds.time)), args)
+                for start in tqdm(range(0, len(ds.time), size))
+            )
+        else:
+            Parallel(n_jobs=args.workers)(
+                delayed(_tmp)(n, args)
+                for n in tqdm(range(len(ds.time)))
+            )
+
     # write_csv(weather_dataframe(0), f"{CSV_PATH}/weather_hour0.csv")